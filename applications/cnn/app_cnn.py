@@ -2,46 +2,44 @@
 # https://www.tensorflow.org/tutorials/images/cnn
 import os
 import sys
+import functools
 
 # Eliminate the log infos and warnings of TensorFlow.
 # Letting only error logs showing.
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2' 
 
+# Shared helpers live in applications/common
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from common import threads
+# The thread environment must be set before TensorFlow is imported
+threads.configure_environment(sys.argv)
+
 import tensorflow as tf
 from tensorflow.keras import datasets, layers, models
-from tensorflow.keras.mixed_precision import experimental as mixed_precision
 import tensorflow_datasets as tfds
 import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
 
 import argparse
 from datetime import datetime
 import time
 
-# Number of samples used to train the model
-NB_SAMPLES = 50000
+from common import accumulation, callbacks, dataset, distribute, model_factory, pipeline, precision, profiling, results, xla
 
 # Download the dataset and plotting it
-def download_dataset():
+# Kept for the next configurations of a sweep running in this process
+@functools.lru_cache(maxsize=2)
+def download_dataset(nb_samples=dataset.NB_SAMPLES, seed=None, cache_dir=dataset.CACHE_DIR,
+                     normalize=True):
   #There are 50000 samples in the training dataset. You can select a subset of the traing set here:
   
-  # CIFAR10
-  (train_images, train_labels), (test_images, test_labels) = datasets.cifar10.load_data()
-
-  # Normalize pixel values to be between 0 and 1
-  train_images, test_images = train_images / 255.0, test_images / 255.0
-
-  print("There are " + str(train_images.shape[0]) + " training samples")
-
-  df = pd.DataFrame(list(zip(train_images, train_labels)), columns =['train_images', 'train_labels']) 
+  # CIFAR10, subsampled while the images are still uint8
+  train_images, train_labels, test_images, test_labels = dataset.load_cifar10(nb_samples, seed, cache_dir)
 
-  val = df.sample(NB_SAMPLES) # take only 5% of the samples
-
-  train_images = np.array([ i for i in list(val['train_images'])])
-  train_labels = np.array([ i for i in list(val['train_labels'])])
-
-  print("There are " + str(train_images.shape[0]) + " training samples")
+  # Normalize pixel values to be between 0 and 1,
+  # unless the model or the tf.data pipeline does it
+  if normalize:
+    train_images, test_images = dataset.normalize(train_images), dataset.normalize(test_images)
 
   plot_dataset(train_images, train_labels)
 
@@ -49,8 +47,7 @@ def download_dataset():
 
 # Plotting the dataset
 def plot_dataset(train_images, train_labels):
-  class_names = ['airplane', 'automobile', 'bird', 'cat', 'deer',
-                'dog', 'frog', 'horse', 'ship', 'truck']
+  class_names = dataset.CLASS_NAMES
 
   # plot the dataset
   plt.figure(num=1, figsize=(10,10))
@@ -66,44 +63,69 @@ def plot_dataset(train_images, train_labels):
   #plt.show()
   plt.savefig("dataset.png")
 
-# create the CNN model
-def create_cnn_model():
-  model = models.Sequential()
-  model.add(layers.Conv2D(32, (3, 3), activation='relu', input_shape=(32, 32, 3)))
-  model.add(layers.MaxPooling2D((2, 2)))
-  model.add(layers.Conv2D(64, (3, 3), activation='relu'))
-  model.add(layers.MaxPooling2D((2, 2)))
-  model.add(layers.Conv2D(64, (3, 3), activation='relu'))
-
-  # print the CNN architecture
-  model.summary()
-
-  # make the CNN more complex
-  model.add(layers.Flatten())
-  model.add(layers.Dense(64, activation='relu'))
-  model.add(layers.Dense(10))
-
-  model.summary()
-
-  return model
+# create the CNN model, built once per process and configuration
+def create_cnn_model(normalization='host', policy='float32', strategy=None):
+  return model_factory.get_model(model_factory.cnn_config(normalization, policy), strategy)
 
 # Train the model  and evaluating it
-def train_model(model, batch_size):
-  train_images, train_labels, test_images, test_labels = download_dataset()
-
-  model.compile(optimizer='adam',
-                loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
-                metrics=['accuracy'])
+def train_model(model, flags, strategy=None):
+  strategy = strategy or tf.distribute.get_strategy()
+  # --batch_size samples for every replica
+  batch_size = distribute.global_batch_size(flags.batch_size, strategy)
+  # The tf.data pipelines scale the uint8 images in their map()
+  normalize = flags.normalization == 'host' and flags.input_pipeline == 'numpy'
+  train_images, train_labels, test_images, test_labels = download_dataset(flags.nb_samples, flags.seed,
+                                                                          flags.cache_dir, normalize)
+
+  # Set before compile(), which drops the training function already traced
+  accumulation.accumulate_gradients(model, flags.accumulation_steps)
+  micro_batch_size = -(-flags.batch_size // flags.accumulation_steps)
+  if flags.accumulation_steps > 1:
+    print('Accumulating the gradients of %d micro-batches of %d samples per replica'
+          % (flags.accumulation_steps, micro_batch_size))
+  with strategy.scope():
+    model.compile(optimizer=precision.wrap_optimizer('adam'),
+                  loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+                  metrics=['accuracy'],
+                  **xla.compile_arguments(flags.jit))
 
   # Create a TensorBoard callback
-  logs = "logs_load/" + str(batch_size) + "_" + datetime.now().strftime("%Y%m%d-%H%M%S")
+  if flags.input_pipeline == 'numpy':
+    logs = "logs_load/"
+  else:
+    logs = "logs_" + flags.input_pipeline + "/"
+  # The pid tells apart the runs of a parallel sweep started in the same second
+  logs += str(flags.batch_size) + "_" + datetime.now().strftime("%Y%m%d-%H%M%S") + "_" + str(os.getpid())
   
+  # The steps are profiled by the windows of --profile
   tboard_callback = tf.keras.callbacks.TensorBoard(log_dir = logs,
                                                   histogram_freq = 1,
-                                                  profile_batch='500,520')
-
-  history = model.fit(train_images, train_labels, batch_size=batch_size, epochs=10, 
-                      validation_data=(test_images, test_labels), callbacks = [tboard_callback])
+                                                  profile_batch=0)
+  throughput_callback = callbacks.ThroughputCallback(batch_size, len(train_images),
+                                                     strategy.num_replicas_in_sync)
+  fit_callbacks = [throughput_callback]
+  # The other workers of a multi-worker run write no logs
+  chief = distribute.is_chief(strategy)
+  if chief:
+    fit_callbacks.append(tboard_callback)
+    # Read by analyze_profiles.py --group
+    results.write_config(logs, os.path.basename(__file__), flags)
+  if flags.profile and chief:
+    fit_callbacks.append(profiling.ProfilerCallback(logs + "/train", flags.profile))
+
+  if flags.input_pipeline == 'numpy':
+    history = model.fit(train_images, train_labels, batch_size=batch_size, epochs=flags.epochs, 
+                        validation_data=(test_images, test_labels), callbacks = fit_callbacks)
+  else:
+    map_fn = pipeline.normalize_img if flags.normalization == 'host' else None
+    # Reshuffled at every epoch as the arrays of the numpy pipeline, the test set kept in order
+    ds_train = pipeline.from_arrays(train_images, train_labels, batch_size, flags.input_pipeline, map_fn,
+                                    flags.tf_data_threads, shuffle=True)
+    ds_test = pipeline.from_arrays(test_images, test_labels, batch_size, flags.input_pipeline, map_fn,
+                                   flags.tf_data_threads)
+    # The batch size is set by the pipeline
+    history = model.fit(ds_train, epochs=flags.epochs,
+                        validation_data=ds_test, callbacks = fit_callbacks)
 
   # Evaluate the model
   plt.figure(num=2, figsize=(10,10))
@@ -115,12 +137,27 @@ def train_model(model, batch_size):
   plt.legend(loc='lower right')
   fig_name = "accuracy_load.png" 
   plt.savefig(fig_name)
+  # The next run of a sweep in this process starts from a new figure
+  plt.close(2)
 
-  test_loss, test_acc = model.evaluate(test_images, test_labels, batch_size=batch_size, verbose=2)
+  if flags.input_pipeline == 'numpy':
+    test_loss, test_acc = model.evaluate(test_images, test_labels, batch_size=batch_size, verbose=2)
+  else:
+    test_loss, test_acc = model.evaluate(ds_test, verbose=2)
   print(test_acc)
 
+  if flags.results_file and chief:
+    record = results.create_record(os.path.basename(__file__), flags, throughput_callback.epoch_times,
+                                   len(train_images), test_accuracy=test_acc,
+                                   throughput_summary=throughput_callback.summary(),
+                                   micro_batch_size=micro_batch_size)
+    results.append_record(flags.results_file, record)
+
   print("Validation:")
-  model.evaluate(test_images, test_labels)
+  if flags.input_pipeline == 'numpy':
+    model.evaluate(test_images, test_labels)
+  else:
+    model.evaluate(ds_test)
 
 # Create the argument parser
 def create_arg_parser():
@@ -135,9 +172,22 @@ def create_arg_parser():
   parser.add_argument('--mixed_precision', type=int, choices=[0,1], 
                     default=0, required=False,
                     help='Define the mixed precision strategy or not')
-  parser.add_argument('--policy_type', type=int, choices=[16, 32],
-                    default=16, required=False,
-                    help="Setting the policy on: 16 for mixed_float16 or 32 for float32")
+  parser.add_argument('--policy_type', type=str, choices=precision.POLICY_TYPE_CHOICES,
+                    default='16', required=False,
+                    help="Setting the policy on: 16 for mixed_float16, bf16 for mixed_bfloat16 or 32 for float32")
+  parser.add_argument('--input_pipeline', type=str, choices=pipeline.INPUT_PIPELINE_CHOICES,
+                    default='numpy', required=False,
+                    help='Feeding NumPy arrays, or a tf.data pipeline: plain, with cache, '
+                         'or with cache, parallel map and prefetch')
+  dataset.add_dataset_arguments(parser)
+  parser.add_argument('--epochs', type=int, default=10,
+                    help='Number of training epochs')
+  accumulation.add_accumulation_arguments(parser)
+  xla.add_xla_arguments(parser)
+  threads.add_thread_arguments(parser)
+  distribute.add_strategy_arguments(parser)
+  profiling.add_profiler_arguments(parser)
+  results.add_results_arguments(parser)
   return parser
 
 def main(argv):
@@ -149,27 +199,27 @@ def main(argv):
   # Setting the batch size
   batch_size = flags.batch_size
   print('Setting batch size = ', batch_size)
+  if not 1 <= flags.accumulation_steps <= batch_size:
+    parser.error('--accumulation_steps must be between 1 and the batch size')
 
+  # TF_GPU_THREAD_MODE is set by threads.configure_environment()
   if flags.gpu_mode == 1:
     print('Setting the GPU on private mode')
-    os.environ['TF_GPU_THREAD_MODE'] = 'gpu_private'
+  threads.configure_tensorflow(flags)
+
+  # Created first, the logical CPU devices are set before TensorFlow initializes
+  strategy = distribute.create_strategy(flags.strategy, flags.nb_replicas)
+  print('Number of replicas: %d' % strategy.num_replicas_in_sync)
 
+  # Set for every run, a sweep in this process must not inherit the previous policy
+  policy = precision.set_policy(precision.policy_name(flags.mixed_precision, flags.policy_type))
   if flags.mixed_precision == 1:
     print("Setting the mixed precision policy")
-    if flags.policy_type == 16:
-      # Defining the precision strategy
-      policy = mixed_precision.Policy('mixed_float16')
-      mixed_precision.set_policy(policy)
-    elif flags.policy_type == 32:
-      # Defining the precision strategy
-      policy = mixed_precision.Policy('float32')
-      mixed_precision.set_policy(policy)
-
     print('Compute dtype: %s' % policy.compute_dtype)
     print('Variable dtype: %s' % policy.variable_dtype)
 
-  model = create_cnn_model()
-  train_model(model, batch_size)
+  model = create_cnn_model(flags.normalization, policy.name, strategy)
+  train_model(model, flags, strategy)
 
 
 if __name__ == '__main__':
@@ -6,15 +6,22 @@ import sys
 # To disable info and warning logs
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
+# Shared helpers live in applications/common
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from common import threads
+# The thread environment must be set before TensorFlow is imported
+threads.configure_environment(sys.argv)
+
 import tensorflow as tf
 from tensorflow.keras import layers, models, datasets
-from tensorflow.keras.mixed_precision import experimental as mixed_precision
 import tensorflow_datasets as tfds
 
 import argparse
 from datetime import datetime
 import time
 
+from common import callbacks, model_factory, pipeline, precision, profiling, results, xla
+
 # Start time of the application
 start_time = time.time()
 
@@ -31,14 +38,23 @@ def create_arg_parser():
   parser.add_argument('--mixed_precision', type=int, choices=[0,1], 
                     default=0, required=False,
                     help='Define the mixed precision strategy or not')
-  parser.add_argument('--policy_type', type=int, choices=[16, 32],
-                    default=16, required=False,
-                    help="Setting the policy on: 16 for mixed_float16 or 32 for float32")
+  parser.add_argument('--policy_type', type=str, choices=precision.POLICY_TYPE_CHOICES,
+                    default='16', required=False,
+                    help="Setting the policy on: 16 for mixed_float16, bf16 for mixed_bfloat16 or 32 for float32")
+  pipeline.add_pipeline_arguments(parser)
+  parser.add_argument('--epochs', type=int, default=10,
+                    help='Number of training epochs')
+  xla.add_xla_arguments(parser)
+  threads.add_thread_arguments(parser)
+  profiling.add_profiler_arguments(parser)
+  results.add_results_arguments(parser)
   return parser
 
-def normalize_img(image, label):
-  """Normalizes images: `uint8` -> `float32`."""
-  return tf.cast(image, tf.float32) / 255., label
+def cache_file(suffix):
+  """Returns the tf.data cache file of a split, empty to cache in memory."""
+  if flags.cache_file == '':
+    return ''
+  return flags.cache_file + '_' + suffix
 
 # Getting the arguments
 parser = create_arg_parser()
@@ -49,20 +65,14 @@ flags = parser.parse_args(args=argv[1:])
 batch_size = flags.batch_size
 print('Setting batch size = ', batch_size)
 
+# TF_GPU_THREAD_MODE is set by threads.configure_environment()
 if flags.gpu_mode == 1:
   print('Setting the GPU on private mode')
-  os.environ['TF_GPU_THREAD_MODE'] = 'gpu_private'
+threads.configure_tensorflow(flags)
 
+policy = precision.set_policy(precision.policy_name(flags.mixed_precision, flags.policy_type))
 if flags.mixed_precision == 1:
   print("Setting the mixed precision policy")
-  # Defining the precision strategy
-  if flags.policy_type == 16:
-    policy = mixed_precision.Policy('mixed_float16')
-    mixed_precision.set_policy(policy)
-  elif flags.policy_type == 32:
-    policy = mixed_precision.Policy('float32')
-    mixed_precision.set_policy(policy)
-
   print('Compute dtype: %s' % policy.compute_dtype)
   print('Variable dtype: %s' % policy.variable_dtype)
 
@@ -72,53 +82,54 @@ if flags.mixed_precision == 1:
                                         as_supervised=True,
                                         with_info=True)
 
-ds_train = ds_train.map(normalize_img,
-                        num_parallel_calls=tf.data.experimental.AUTOTUNE)
-ds_train = ds_train.batch(128)
-ds_train = ds_train.cache()
-ds_train = ds_train.prefetch(tf.data.experimental.AUTOTUNE)
+ds_train = pipeline.build_pipeline(ds_train, batch_size,
+                                  shuffle_buffer=flags.shuffle_buffer,
+                                  cache_position=flags.cache_position,
+                                  cache_file=cache_file('train'),
+                                  private_threads=flags.tf_data_threads)
 
-ds_test = ds_test.map(normalize_img,
-                      num_parallel_calls=tf.data.experimental.AUTOTUNE)
-ds_test = ds_test.batch(128)
-ds_test = ds_test.cache()
-ds_test = ds_test.prefetch(tf.data.experimental.AUTOTUNE)
+ds_test = pipeline.build_pipeline(ds_test, batch_size,
+                                 cache_position=flags.cache_position,
+                                 cache_file=cache_file('test'),
+                                 private_threads=flags.tf_data_threads)
 
 print("There are " + str(ds_info.splits['train'].num_examples) + " training samples")
 
-model = models.Sequential()
-model.add(layers.Conv2D(32, (3, 3), activation='relu', input_shape=(32, 32, 3)))
-model.add(layers.MaxPooling2D((2, 2)))
-model.add(layers.Conv2D(64, (3, 3), activation='relu'))
-model.add(layers.MaxPooling2D((2, 2)))
-model.add(layers.Conv2D(64, (3, 3), activation='relu'))
-
-# print the CNN architecture
-model.summary()
-
-# make the CNN more complex
-model.add(layers.Flatten())
-model.add(layers.Dense(64, activation='relu'))
-model.add(layers.Dense(10))
-
-model.summary()
+# create the CNN model, see common/model_factory.py
+model = model_factory.create_model(model_factory.cnn_config(policy=policy.name))
 
 # Compile the CNN model
-model.compile(optimizer='adam',
+model.compile(optimizer=precision.wrap_optimizer('adam'),
                 loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
-                metrics=['accuracy'])
+                metrics=['accuracy'],
+                **xla.compile_arguments(flags.jit))
 
 # Create a TensorBoard callback
-logs = "log_prefetch/" + str(batch_size) + "_" + datetime.now().strftime("%Y%m%d-%H%M%S")
+# The pid tells apart the runs of a parallel sweep started in the same second
+logs = "log_prefetch/" + str(batch_size) + "_" + datetime.now().strftime("%Y%m%d-%H%M%S") + "_" + str(os.getpid())
 
+# The steps are profiled by the windows of --profile
 tboard_callback = tf.keras.callbacks.TensorBoard(log_dir = logs,
                                                   histogram_freq = 1,
-                                                  profile_batch='500,520')
+                                                  profile_batch=0)
+throughput_callback = callbacks.ThroughputCallback(batch_size, ds_info.splits['train'].num_examples)
+fit_callbacks = [tboard_callback, throughput_callback]
+# Read by analyze_profiles.py --group
+results.write_config(logs, os.path.basename(__file__), flags)
+if flags.profile:
+  fit_callbacks.append(profiling.ProfilerCallback(logs + "/train", flags.profile))
 # Train the model
+# The batch size is set by the pipeline
 history = model.fit(ds_train,
-                    epochs=10,
-                    batch_size=batch_size,
+                    epochs=flags.epochs,
                     validation_data=ds_test,
-                    callbacks = [tboard_callback])
+                    callbacks = fit_callbacks)
+
+if flags.results_file:
+  record = results.create_record(os.path.basename(__file__), flags, throughput_callback.epoch_times,
+                                 ds_info.splits['train'].num_examples,
+                                 val_accuracy=history.history['val_accuracy'][-1],
+                                 throughput_summary=throughput_callback.summary())
+  results.append_record(flags.results_file, record)
 
 print("Working time: %s seconds" % (time.time() - start_time))
@@ -13,6 +13,10 @@ import argparse
 from datetime import datetime
 import time
 
+# Shared helpers live in applications/common
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from common import model_factory, precision
+
 start_time = time.time()
 
 def normalize_img(image, label):
@@ -34,24 +38,10 @@ ds_test = ds_test.prefetch(tf.data.experimental.AUTOTUNE)
 
 # print("There are " + str(ds_info.splits['train'].num_examples) + " training samples")
 
-model = models.Sequential()
-model.add(layers.Conv2D(32, (3, 3), activation='relu', input_shape=(32, 32, 3)))
-model.add(layers.MaxPooling2D((2, 2)))
-model.add(layers.Conv2D(64, (3, 3), activation='relu'))
-model.add(layers.MaxPooling2D((2, 2)))
-model.add(layers.Conv2D(64, (3, 3), activation='relu'))
-
-# print the CNN architecture
-model.summary()
-
-# make the CNN more complex
-model.add(layers.Flatten())
-model.add(layers.Dense(64, activation='relu'))
-model.add(layers.Dense(10))
-
-model.summary()
+# create the CNN model, see common/model_factory.py
+model = model_factory.create_model(model_factory.cnn_config())
 
-model.compile(optimizer='adam',
+model.compile(optimizer=precision.wrap_optimizer('adam'),
                 loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
                 metrics=['accuracy'])
 
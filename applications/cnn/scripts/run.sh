@@ -2,36 +2,24 @@
 
 cd ..
 
-for (( counter = 8; counter <= 32768; counter *= 2 )); do
-	GPU_MODE=0
-	MIXED_PRECISION=0
-	POLICY_TYPE=16
-	LOAD_TYPE=0
-
-	working_time=$(python3 app_cnn.py --batch_size $counter --prefetch_dataset $LOAD_TYPE --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-	GPU_MODE=1
-	working_time=$(python3 app_cnn.py --batch_size $counter --prefetch_dataset $LOAD_TYPE --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-	GPU_MODE=0
-	MIXED_PRECISION=1
-	POLICY_TYPE=16
-	working_time=$(python3 app_cnn.py --batch_size $counter --prefetch_dataset $LOAD_TYPE --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-	POLICY_TYPE=32
-	working_time=$(python3 app_cnn.py --batch_size $counter --prefetch_dataset $LOAD_TYPE --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE"
-	echo $working_time
-
-	GPU_MODE=1
-	POLICY_TYPE=16
-	working_time=$(python3 app_cnn.py --batch_size $counter --prefetch_dataset $LOAD_TYPE --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-	POLICY_TYPE=32
-	working_time=$(python3 app_cnn.py --batch_size $counter --prefetch_dataset $LOAD_TYPE --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-done
+# Input pipeline of app_cnn.py: numpy, tfdata, tfdata_cache or tfdata_prefetch
+INPUT_PIPELINE=${1:-numpy}
+# Number of configurations running at the same time, on disjoint CPU cores
+JOBS=${JOBS:-1}
+# XLA compilation of the training step, 0 and/or 1, comma-separated
+JIT=${JIT:-0}
+# Set IN_PROCESS=1 to run the configurations one after the other in a single
+# process, skipping the start of Python and TensorFlow for every run
+IN_PROCESS=${IN_PROCESS:-}
+# Micro-batches of the gradient accumulation, 1 for none, comma-separated
+ACCUMULATION=${ACCUMULATION:-1}
+# Largest batch sizes found by ../common/batch_probe.py, the batch sizes over them are skipped
+BATCH_LIMITS=${BATCH_LIMITS:-}
+# Structured records of the runs, an interrupted sweep resumes where it stopped
+RESULTS_FILE=${RESULTS_FILE:-results.jsonl}
+
+python3 ../common/sweep.py app_cnn.py \
+	--batch_size 8 16 32 64 128 256 512 1024 2048 4096 8192 16384 32768 \
+	--grid input_pipeline=$INPUT_PIPELINE jit=$JIT accumulation_steps=$ACCUMULATION \
+	--jobs $JOBS --retries 1 \
+	--results_file $RESULTS_FILE --resume ${BATCH_LIMITS:+--batch_limits $BATCH_LIMITS} ${IN_PROCESS:+--in_process}
@@ -2,35 +2,17 @@
 
 cd ..
 
-for (( counter = 8; counter <= 32768; counter *= 2 )); do
-	GPU_MODE=0
-	MIXED_PRECISION=0
-	POLICY_TYPE=16
-
-	working_time=$(python3 app_prefetch.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-	GPU_MODE=1
-	working_time=$(python3 app_prefetch.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-	GPU_MODE=0
-	MIXED_PRECISION=1
-	POLICY_TYPE=16
-	working_time=$(python3 app_prefetch.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-	POLICY_TYPE=32
-	working_time=$(python3 app_prefetch.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE"
-	echo $working_time
-
-	GPU_MODE=1
-	POLICY_TYPE=16
-	working_time=$(python3 app_prefetch.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-	POLICY_TYPE=32
-	working_time=$(python3 app_prefetch.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-	echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-done
+# Number of configurations running at the same time, on disjoint CPU cores
+JOBS=${JOBS:-1}
+# XLA compilation of the training step, 0 and/or 1, comma-separated
+JIT=${JIT:-0}
+# Largest batch sizes found by ../common/batch_probe.py, the batch sizes over them are skipped
+BATCH_LIMITS=${BATCH_LIMITS:-}
+# Structured records of the runs, an interrupted sweep resumes where it stopped
+RESULTS_FILE=${RESULTS_FILE:-results.jsonl}
+
+python3 ../common/sweep.py app_prefetch.py \
+	--batch_size 8 16 32 64 128 256 512 1024 2048 4096 8192 16384 32768 \
+	--grid jit=$JIT \
+	--jobs $JOBS --retries 1 \
+	--results_file $RESULTS_FILE --resume ${BATCH_LIMITS:+--batch_limits $BATCH_LIMITS}
@@ -0,0 +1 @@
+# Helpers shared by the CNN and ResNet50 applications.
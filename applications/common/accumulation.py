@@ -0,0 +1,72 @@
+# Gradient accumulation: large batches in the memory of small ones.
+#
+# With --accumulation_steps N a batch of --batch_size samples is split into
+# N micro-batches. The forward and backward passes run on one micro-batch
+# at a time, their gradients are summed, and the optimizer is applied once
+# per batch: the update of the whole batch, with the activations of a
+# micro-batch only in memory. The batch normalization statistics are those
+# of the micro-batches.
+#
+# The loss of every micro-batch is weighted by its share of the batch, so
+# that the sum of the gradients is the gradient of the mean loss of the
+# batch. Under mixed_float16 the micro-batch losses are scaled by the loss
+# scale of the optimizer and the sum is unscaled once: a non-finite
+# gradient of any micro-batch makes the LossScaleOptimizer skip the update
+# and lower the scale, as with a single batch.
+import tensorflow as tf
+
+from common import precision
+
+def _accumulating_train_step(model, nb_micro_batches):
+  def train_step(data):
+    x, y = data[0], data[1]
+    batch_size = tf.shape(x)[0]
+    # The last micro-batch is smaller when the batch does not split evenly
+    micro_batch_size = (batch_size + nb_micro_batches - 1) // nb_micro_batches
+    nb_steps = (batch_size + micro_batch_size - 1) // micro_batch_size
+    variables = model.trainable_variables
+
+    def accumulate(step, accumulated):
+      start = step * micro_batch_size
+      end = tf.minimum(start + micro_batch_size, batch_size)
+      x_micro, y_micro = x[start:end], y[start:end]
+      with tf.GradientTape() as tape:
+        y_pred = model(x_micro, training=True)
+        loss = model.compiled_loss(y_micro, y_pred, regularization_losses=model.losses)
+        # Share of the micro-batch in the mean loss of the batch
+        loss *= tf.cast(end - start, loss.dtype) / tf.cast(batch_size, loss.dtype)
+        scaled_loss = precision.scale_loss(model.optimizer, loss)
+      gradients = tape.gradient(scaled_loss, variables)
+      model.compiled_metrics.update_state(y_micro, y_pred)
+      return step + 1, [total + tf.convert_to_tensor(gradient) if gradient is not None else total
+                        for total, gradient in zip(accumulated, gradients)]
+
+    # The sums are loop variables, one copy of the weights whatever the strategy
+    _, accumulated = tf.while_loop(lambda step, accumulated: step < nb_steps, accumulate,
+                                   (tf.constant(0), [tf.zeros_like(v) for v in variables]))
+    gradients = precision.unscale_gradients(model.optimizer, accumulated)
+    model.optimizer.apply_gradients(zip(gradients, variables))
+    return {metric.name: metric.result() for metric in model.metrics}
+  return train_step
+
+def accumulate_gradients(model, nb_micro_batches=1):
+  """Makes model.fit() accumulate the gradients of `nb_micro_batches` micro-batches per batch.
+
+  To be called before model.compile(), which drops the training function
+  already traced. With 1 micro-batch the default training step of the
+  model is restored, a model reused by a sweep in this process being
+  called for every run.
+  """
+  # The instance attribute hides the train_step() of the class
+  if nb_micro_batches > 1:
+    model.train_step = _accumulating_train_step(model, nb_micro_batches)
+  elif 'train_step' in vars(model):
+    del model.train_step
+  return model
+
+def add_accumulation_arguments(parser):
+  """Adds the gradient accumulation option to `parser`."""
+  parser.add_argument('--accumulation_steps', type=int, default=1,
+                    help='Micro-batches of a batch, their gradients summed before a single update, '
+                         '1 for no accumulation')
+  return parser
@@ -0,0 +1,318 @@
+# Offline analysis of the profiler output of the runs.
+#
+# Walks the given log directories for the profile captures written by the
+# profiler (<run>/train/plugins/profile/<capture>/) and prints, for every
+# capture, the step time, the share of it spent waiting for the input, the
+# host and device idle time, the peak memory and the ops taking the most
+# self time. The captures are ranked so that the configurations of a sweep
+# can be compared without opening TensorBoard.
+#
+# The figures come from the *.trace.json.gz file, which is read as a stream
+# of events: the trace is never loaded as a whole. The peak memory comes
+# from the *.memory_profile.json.gz file. With --group the captures of the
+# runs of a same configuration, as written by the application in the
+# config.json of its log directory, are averaged.
+#
+# Example, from applications/cnn:
+#   python3 ../common/analyze_profiles.py logs_load log_prefetch --top 5
+import os
+import re
+import sys
+import glob
+import gzip
+import json
+import argparse
+
+import results
+
+# Events of the host waiting for the next batch of the input pipeline
+INPUT_EVENTS = ['IteratorGetNext', 'IteratorGetNextAsOptional',
+                'MultiDeviceIteratorGetNextFromShard']
+
+# Event wrapping every training step, on the Python thread
+STEP_EVENT = 'train_function'
+
+SORT_KEYS = ['step_ms', 'input_bound_pct', 'host_idle_pct', 'device_idle_pct', 'peak_memory_mb']
+
+_CHUNK_SIZE = 1 << 20
+
+# Date and pid suffix of the log directory of a run, e.g. 1024_20210203-214752_4242,
+# for the runs without configuration file
+_RUN_DATE = re.compile(r'[_-]?\d{8}-\d{6}(_\d+)?$')
+
+def iter_trace_events(path):
+  """Yields the events of a Chrome trace file one by one.
+
+  Only the events being decoded are held in memory.
+  """
+  decoder = json.JSONDecoder()
+  with gzip.open(path, 'rt') as f:
+    buffer = ''
+    # Skip everything up to the list of events
+    while True:
+      chunk = f.read(_CHUNK_SIZE)
+      buffer += chunk
+      start = buffer.find('"traceEvents"')
+      if start >= 0:
+        start = buffer.find('[', start)
+        if start >= 0:
+          buffer = buffer[start + 1:]
+          break
+      if not chunk:
+        return
+
+    position = 0
+    eof = False
+    while True:
+      # Skip the separators
+      while position < len(buffer) and buffer[position] in ' \t\r\n,':
+        position += 1
+      if position < len(buffer) and buffer[position] == ']':
+        return
+      try:
+        if position >= len(buffer):
+          raise ValueError('Need more data')
+        event, position = decoder.raw_decode(buffer, position)
+      except ValueError:
+        if eof:
+          raise
+        # The event is cut by the end of the buffer
+        chunk = f.read(_CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+        continue
+      yield event
+
+def _merge_intervals(intervals):
+  """Returns the total length covered by a list of (start, end) intervals."""
+  total = 0.
+  current_start = current_end = None
+  for start, end in sorted(intervals):
+    if current_end is None or start > current_end:
+      if current_end is not None:
+        total += current_end - current_start
+      current_start, current_end = start, end
+    else:
+      current_end = max(current_end, end)
+  if current_end is not None:
+    total += current_end - current_start
+  return total
+
+def analyze_trace(path):
+  """Computes the step, input, idle and op figures of a trace file.
+
+  Times in the trace are in microseconds.
+  """
+  process_names = {}
+  thread_names = {}
+  op_self_times = {}
+  # Top-level busy intervals, to compute the idle time
+  busy = {'host': [], 'device': []}
+  step_times = []
+  input_time = 0.
+  first_ts = last_ts = None
+
+  # Open events of the current thread: [end, name, self time, group]
+  stack = []
+  current_thread = None
+
+  def close(event):
+    end, name, self_time, group = event
+    if group is not None:
+      op_self_times[name] = op_self_times.get(name, 0.) + self_time
+
+  for event in iter_trace_events(path):
+    phase = event.get('ph')
+    if phase == 'M':
+      if event.get('name') == 'process_name':
+        process_names[event['pid']] = event['args']['name']
+      elif event.get('name') == 'thread_name':
+        thread_names[(event['pid'], event['tid'])] = event['args']['name']
+      continue
+    if phase != 'X':
+      continue
+
+    thread = (event['pid'], event['tid'])
+    ts, dur, name = event['ts'], event.get('dur', 0.), event['name']
+    if thread != current_thread:
+      # The events come grouped by thread and sorted by time
+      while stack:
+        close(stack.pop())
+      current_thread = thread
+    while stack and stack[-1][0] <= ts:
+      close(stack.pop())
+
+    first_ts = ts if first_ts is None else min(first_ts, ts)
+    last_ts = ts + dur if last_ts is None else max(last_ts, ts + dur)
+
+    if process_names.get(event['pid'], '').startswith('/device:'):
+      group = 'device'
+    elif thread_names.get(thread, '').startswith('tf_'):
+      # Op kernels and tf.data run on the tf_* threads
+      group = 'host'
+    else:
+      group = None
+
+    if name == STEP_EVENT:
+      step_times.append(dur)
+    if name in INPUT_EVENTS:
+      input_time += dur
+    if stack:
+      stack[-1][2] -= dur
+    elif group is not None:
+      busy[group].append((ts, ts + dur))
+    stack.append([ts + dur, name, dur, group])
+
+  while stack:
+    close(stack.pop())
+
+  span = (last_ts - first_ts) if first_ts is not None else 0.
+  def idle_pct(group):
+    if not busy[group] or span <= 0:
+      return None
+    return 100. * (span - _merge_intervals(busy[group])) / span
+
+  step_total = sum(step_times)
+  return {
+    'steps': len(step_times),
+    'step_ms': step_total / len(step_times) / 1000. if step_times else None,
+    'input_bound_pct': 100. * input_time / step_total if step_total else None,
+    'host_idle_pct': idle_pct('host'),
+    'device_idle_pct': idle_pct('device'),
+    'op_self_times': op_self_times,
+  }
+
+def peak_memory(path):
+  """Returns the highest peak of the allocators of a memory profile, in MB."""
+  with gzip.open(path, 'rt') as f:
+    profile = json.load(f)
+  peaks = [int(allocator.get('profileSummary', {}).get('peakStats', {}).get('peakBytesInUse', 0))
+           for allocator in profile.get('memoryProfilePerAllocator', {}).values()]
+  if not peaks:
+    return None
+  return max(peaks) / 2.**20
+
+def find_captures(log_dirs):
+  """Returns the capture directories found under `log_dirs`."""
+  captures = []
+  for log_dir in log_dirs:
+    pattern = os.path.join(log_dir, '**', 'plugins', 'profile', '*', '')
+    captures += sorted(glob.glob(pattern, recursive=True))
+  return captures
+
+def analyze_capture(capture_dir, nb_top_ops):
+  """Returns the figures of one profile capture, None without trace."""
+  traces = glob.glob(os.path.join(capture_dir, '*.trace.json.gz'))
+  if not traces:
+    return None
+  summary = analyze_trace(traces[0])
+  memory_profiles = glob.glob(os.path.join(capture_dir, '*.memory_profile.json.gz'))
+  summary['peak_memory_mb'] = peak_memory(memory_profiles[0]) if memory_profiles else None
+
+  op_self_times = summary.pop('op_self_times')
+  top_ops = sorted(op_self_times.items(), key=lambda item: item[1], reverse=True)[:nb_top_ops]
+  summary['top_ops'] = [{'name': name, 'self_ms': self_time / 1000.} for name, self_time in top_ops]
+  # <run>/train/plugins/profile/<capture>
+  summary['capture'] = os.path.normpath(capture_dir).replace(os.sep + 'plugins' + os.sep + 'profile', '')
+  return summary
+
+def run_configuration(capture):
+  """Returns the configuration written by the run of a capture, None without it."""
+  # <run>/train/<capture>
+  return results.load_config(os.path.dirname(os.path.dirname(capture)))
+
+def configuration_name(run, runs):
+  """Returns the script of `run` with its options which differ among the `runs` of it."""
+  others = [other['config'] for other in runs if other['script'] == run['script']]
+  options = ['%s=%s' % (name, value) for name, value in sorted(run['config'].items())
+             if any(other.get(name) != value for other in others)]
+  return ' '.join([run['script']] + options)
+
+def aggregate(summaries):
+  """Averages the figures of the captures of every configuration.
+
+  The configuration of a run is the one written in its log directory by
+  the application. The runs logged before it was written are grouped by
+  their directory without its date.
+  """
+  groups = {}
+  runs = {}
+  for summary in summaries:
+    run = run_configuration(summary['capture'])
+    if run is None:
+      key = _RUN_DATE.sub('', os.path.dirname(os.path.dirname(summary['capture'])))
+    else:
+      key = json.dumps(run, sort_keys=True)
+      runs[key] = run
+    groups.setdefault(key, []).append(summary)
+
+  aggregated = []
+  for key, group in groups.items():
+    name = configuration_name(runs[key], runs.values()) if key in runs else key
+    result = {'capture': name + ' (%d runs)' % len(group),
+              'steps': sum(summary['steps'] for summary in group),
+              'top_ops': []}
+    for key in SORT_KEYS:
+      values = [summary[key] for summary in group if summary[key] is not None]
+      result[key] = sum(values) / len(values) if values else None
+    aggregated.append(result)
+  return aggregated
+
+def _format(value, width):
+  if value is None:
+    return '-'.rjust(width)
+  return ('%.1f' % value).rjust(width)
+
+def print_report(summaries, nb_top_ops):
+  columns = ['step_ms', 'input_bound_pct', 'host_idle_pct', 'device_idle_pct', 'peak_memory_mb']
+  print('steps'.rjust(6) + ''.join(column.rjust(16) for column in columns) + '  capture')
+  for summary in summaries:
+    print(str(summary['steps']).rjust(6)
+          + ''.join(_format(summary[column], 16) for column in columns)
+          + '  ' + summary['capture'])
+  if nb_top_ops > 0:
+    for summary in summaries:
+      if not summary['top_ops']:
+        continue
+      print()
+      print(summary['capture'] + ': top ops by self time')
+      for op in summary['top_ops']:
+        print(_format(op['self_ms'], 12) + ' ms  ' + op['name'])
+
+def create_arg_parser():
+  parser = argparse.ArgumentParser(description='Summarizing the profiler output of the runs.')
+  parser.add_argument('log_dirs', type=str, nargs='+',
+                    help='Log directories holding the profile captures, searched recursively')
+  parser.add_argument('--top', type=int, default=10,
+                    help='Number of ops listed by self time for every capture')
+  parser.add_argument('--sort', type=str, choices=SORT_KEYS, default='step_ms',
+                    help='Figure the captures are ranked by, ascending')
+  parser.add_argument('--group', action='store_true',
+                    help='Averaging the captures of the runs of a same configuration')
+  parser.add_argument('--json', action='store_true',
+                    help='Printing one JSON line per capture instead of a table')
+  return parser
+
+def main(argv):
+  parser = create_arg_parser()
+  flags = parser.parse_args(args=argv[1:])
+
+  summaries = []
+  for capture_dir in find_captures(flags.log_dirs):
+    summary = analyze_capture(capture_dir, flags.top)
+    if summary is not None:
+      summaries.append(summary)
+  if flags.group:
+    summaries = aggregate(summaries)
+  # The captures without the figure come last
+  summaries.sort(key=lambda summary: (summary[flags.sort] is None, summary[flags.sort] or 0))
+
+  if flags.json:
+    for summary in summaries:
+      print(json.dumps(summary, sort_keys=True))
+  else:
+    print_report(summaries, flags.top)
+
+if __name__ == '__main__':
+  main(argv=sys.argv)
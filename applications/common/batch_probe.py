@@ -0,0 +1,186 @@
+# Largest batch size of a model that trains without running out of memory.
+#
+# Every trial runs a few training steps of the model at one batch size (the
+# 'optimizer' mode of benchmark.py) in its own process: an OOM error, or
+# the OOM killer, only ends the trial, and the peak host RSS and the peak
+# TF GPU memory of the process are those of this batch size. A trial fails
+# when its process fails or times out, or when its peak RSS is over
+# --memory_limit_mb (the share of the host memory of one job of a parallel
+# sweep). The batch size is doubled from --min_batch_size until a trial
+# fails, then bisected between the last batch size that fitted and the
+# first one that did not, down to --granularity samples.
+#
+# The limits are written to --output, one per model, policy and input
+# resolution, and sweep.py --batch_limits skips the configurations over
+# them. This module does not import TensorFlow, the sweep runner reads the
+# limits without it. Example, from applications:
+#   python3 common/batch_probe.py --model resnet50 --image_sizes 64 256 --output limits.json
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'benchmark.py')
+
+BENCHMARK_LINE = re.compile(r'^Benchmark: (.*)$', re.M)
+
+# Policies of the --mixed_precision and --policy_type options of the
+# applications, as precision.policy_name() without TensorFlow
+_POLICY_TYPES = {'16': 'mixed_float16', '32': 'float32', 'bf16': 'mixed_bfloat16'}
+
+# Input resolution of the applications without an --image_size option
+_DEFAULT_IMAGE_SIZES = {'cnn': 32, 'resnet50': 256}
+
+def run_trial(model, policy, image_size, batch_size, nb_steps=2, timeout=None, memory_limit_mb=0):
+  """Runs `nb_steps` training steps at `batch_size` in a new process.
+
+  Returns the measures of the trial: whether the batch fits, the peak host
+  RSS and TF GPU memory in MB, and the samples/sec.
+  """
+  command = [sys.executable, BENCHMARK, '--worker', '1', '--models', model,
+             '--modes', 'optimizer', '--policies', policy, '--image_size', str(image_size),
+             '--batch_sizes', str(batch_size), '--warmup_steps', '1', '--steps', str(nb_steps),
+             '--repetitions', '1']
+  trial = {'batch_size': batch_size, 'fits': False, 'peak_rss_mb': None, 'peak_device_mb': None,
+           'samples_per_sec': None}
+  try:
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             universal_newlines=True, timeout=timeout)
+  except subprocess.TimeoutExpired:
+    print("Timed out: batch size %d" % batch_size, file=sys.stderr)
+    return trial
+
+  matches = BENCHMARK_LINE.findall(process.stdout)
+  if process.returncode != 0 or not matches:
+    # Killed by the OOM killer: -9
+    print("Failed (exit code %d): batch size %d" % (process.returncode, batch_size), file=sys.stderr)
+    return trial
+  measures = json.loads(matches[-1])
+  trial.update({name: measures[name] for name in ['peak_rss_mb', 'peak_device_mb', 'samples_per_sec']})
+  trial['fits'] = memory_limit_mb <= 0 or measures['peak_rss_mb'] <= memory_limit_mb
+  return trial
+
+def find_max_batch_size(run, min_batch_size=8, max_batch_size=32768, granularity=8):
+  """Searches the largest batch size for which `run(batch_size)` fits.
+
+  Returns it, None if even `min_batch_size` does not fit, with the list
+  of the trials.
+  """
+  trials = []
+
+  def fits(batch_size):
+    trial = run(batch_size)
+    trials.append(trial)
+    print(json.dumps(trial), flush=True)
+    return trial['fits']
+
+  # Doubling up to the first failure
+  good, bad = None, None
+  batch_size = min_batch_size
+  while bad is None:
+    if fits(batch_size):
+      good = batch_size
+      if batch_size >= max_batch_size:
+        break
+      batch_size = min(2 * batch_size, max_batch_size)
+    else:
+      bad = batch_size
+  if good is None:
+    return None, trials
+
+  # Bisection between the last success and the first failure
+  while bad is not None and bad - good > granularity:
+    middle = (good + bad) // 2 // granularity * granularity
+    if middle <= good:
+      break
+    if fits(middle):
+      good = middle
+    else:
+      bad = middle
+  return good, trials
+
+def load_limits(path):
+  """Returns the limits of the file `path`, an empty list when it does not exist."""
+  if not os.path.exists(path):
+    return []
+  with open(path) as f:
+    return json.load(f)
+
+def save_limits(path, new_limits):
+  """Writes `new_limits` to `path`, replacing the limits of the same configurations."""
+  def key(limit):
+    return (limit['model'], limit['policy'], limit['image_size'])
+  limits = {key(limit): limit for limit in load_limits(path)}
+  limits.update((key(limit), limit) for limit in new_limits)
+  with open(path, 'w') as f:
+    json.dump(sorted(limits.values(), key=key), f, indent=2)
+
+def within_limits(limits, script, config):
+  """Tells if the batch size of the sweep `config` of `script` is within the probed limits.
+
+  A configuration without a probed limit is kept. With gradient
+  accumulation the micro-batches are held in memory, not the batch.
+  """
+  model = 'resnet50' if 'resnet50' in os.path.basename(script) else 'cnn'
+  policy = 'float32'
+  if str(config.get('mixed_precision', 0)) == '1':
+    policy = _POLICY_TYPES[str(config.get('policy_type', '16'))]
+  image_size = int(config.get('image_size', _DEFAULT_IMAGE_SIZES[model]))
+  micro_batch_size = -(-int(config['batch_size']) // int(config.get('accumulation_steps', 1)))
+  for limit in limits:
+    if (limit['model'], limit['policy'], limit['image_size']) == (model, policy, image_size):
+      return (limit['max_batch_size'] is not None
+              and micro_batch_size <= limit['max_batch_size'])
+  return True
+
+def create_arg_parser():
+  parser = argparse.ArgumentParser(description='Probing the largest batch size of a model.')
+  parser.add_argument('--model', type=str, choices=sorted(_DEFAULT_IMAGE_SIZES), required=True,
+                    help='Model of the applications to probe')
+  parser.add_argument('--policies', type=str, nargs='+', default=['float32'],
+                    choices=sorted(_POLICY_TYPES.values()),
+                    help='Precision policies to probe')
+  parser.add_argument('--image_sizes', type=int, nargs='+', default=[],
+                    help='Input resolutions of ResNet50 to probe, 256 by default')
+  parser.add_argument('--min_batch_size', type=int, default=8,
+                    help='First batch size of the search')
+  parser.add_argument('--max_batch_size', type=int, default=32768,
+                    help='Largest batch size of the search')
+  parser.add_argument('--granularity', type=int, default=8,
+                    help='Precision of the bisection, in samples')
+  parser.add_argument('--steps', type=int, default=2,
+                    help='Training steps of a trial, after one warm-up step')
+  parser.add_argument('--memory_limit_mb', type=int, default=0,
+                    help='Peak host RSS over which a batch size does not fit, 0 for no limit')
+  parser.add_argument('--timeout', type=int, default=0,
+                    help='Seconds after which a trial is stopped and does not fit, 0 for none')
+  parser.add_argument('--output', type=str, default='batch_limits.json',
+                    help='JSON file of the limits, read by sweep.py --batch_limits')
+  return parser
+
+def main(argv):
+  parser = create_arg_parser()
+  flags = parser.parse_args(args=argv[1:])
+
+  image_sizes = flags.image_sizes or [_DEFAULT_IMAGE_SIZES[flags.model]]
+  if flags.model == 'cnn' and image_sizes != [32]:
+    parser.error('The CNN runs on the 32x32 images only')
+
+  limits = []
+  for policy in flags.policies:
+    for image_size in image_sizes:
+      run = lambda batch_size: run_trial(flags.model, policy, image_size, batch_size, flags.steps,
+                                         flags.timeout or None, flags.memory_limit_mb)
+      max_batch_size, trials = find_max_batch_size(run, flags.min_batch_size,
+                                                   flags.max_batch_size, flags.granularity)
+      print("Largest batch size of %s, %s, %dx%d: %s"
+            % (flags.model, policy, image_size, image_size, max_batch_size), flush=True)
+      limits.append({'model': flags.model, 'policy': policy, 'image_size': image_size,
+                     'max_batch_size': max_batch_size, 'memory_limit_mb': flags.memory_limit_mb,
+                     'trials': sorted(trials, key=lambda trial: trial['batch_size'])})
+  save_limits(flags.output, limits)
+
+if __name__ == '__main__':
+  main(argv=sys.argv)
@@ -0,0 +1,224 @@
+# Synthetic-data microbenchmarks of the CNN and ResNet50 models.
+#
+# A training run of the applications measures the dataset loading, the
+# input pipeline, the validation and the plots along with the model. This
+# benchmark times the model alone, on random tensors already in memory:
+#   forward           the inference step, model(x, training=False)
+#   forward_backward  the loss and its gradients, without the update
+#   optimizer         the whole training step, gradients applied
+# over the matrix of the --models, --modes, --batch_sizes and --policies.
+# Every measure runs --warmup_steps steps first (the tracing is in them),
+# then --repetitions runs of --steps steps: the samples/sec is reported as
+# the mean of the repetitions with its 95% confidence interval.
+#
+# The thread pools are sized once per process, so every thread setting of
+# --intra and --inter runs in its own process. Example, from applications:
+#   python3 common/benchmark.py --models cnn resnet50 --batch_sizes 32 128 --intra 4 8
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+# Shared helpers live in applications/common
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from common import results, threads
+
+MODES = ['forward', 'forward_backward', 'optimizer']
+
+# Optimizer of the training steps and logits or softmax output, as in the applications
+MODELS = {'cnn': {'optimizer': 'adam', 'from_logits': True},
+          'resnet50': {'optimizer': 'rmsprop', 'from_logits': False}}
+
+POLICIES = ['float32', 'mixed_float16', 'mixed_bfloat16']
+
+# Two-sided 95% quantiles of the Student t distribution by degrees of freedom
+_T95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306,
+        9: 2.262, 10: 2.228, 15: 2.131, 20: 2.086, 30: 2.042, 60: 2.000, 120: 1.980}
+
+def confidence_interval(values):
+  """Returns the mean of `values` and the half-width of its 95% confidence interval.
+
+  The half-width is None with less than two values. Between two tabulated
+  degrees of freedom the larger quantile is taken, the interval being wider.
+  """
+  mean = float(np.mean(values))
+  if len(values) < 2:
+    return mean, None
+  df = len(values) - 1
+  t = _T95[max(k for k in _T95 if k <= df)] if df < 120 else 1.96
+  return mean, t * float(np.std(values, ddof=1)) / np.sqrt(len(values))
+
+def build_model(name, policy='float32', image_size=32, head='flatten'):
+  """Builds the model `name` of the applications under `policy`, with random weights.
+
+  The ResNet50 model is the one of app_resnet50.py: the 32x32 images
+  resized to `image_size` inside the model, then ResNet50 and its head.
+  """
+  from tensorflow.keras import layers, models
+  from tensorflow.keras.applications.resnet50 import ResNet50
+  from tensorflow.keras.layers.experimental import preprocessing
+  from common import model_factory, precision
+
+  if name == 'cnn':
+    return model_factory.create_model(model_factory.cnn_config(policy=policy))
+
+  precision.set_policy(policy)
+  model = models.Sequential()
+  model.add(layers.InputLayer(input_shape=(32, 32, 3)))
+  if image_size != 32:
+    model.add(preprocessing.Resizing(image_size, image_size, interpolation='nearest'))
+  model.add(ResNet50(weights=None, include_top=False, input_shape=(image_size, image_size, 3)))
+  for layer in model_factory.build_layers(model_factory.resnet50_head_layers(head)):
+    model.add(layer)
+  return model
+
+def create_step(model, mode, optimizer, from_logits):
+  """Returns the tf.function of one `mode` step on a batch (x, y)."""
+  import tensorflow as tf
+  from common import precision
+
+  loss_fn = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=from_logits)
+
+  def gradients(x, y):
+    with tf.GradientTape() as tape:
+      loss = loss_fn(y, model(x, training=True))
+      scaled_loss = precision.scale_loss(optimizer, loss)
+    scaled_gradients = tape.gradient(scaled_loss, model.trainable_variables)
+    return loss, precision.unscale_gradients(optimizer, scaled_gradients)
+
+  @tf.function
+  def forward(x, y):
+    return model(x, training=False)
+
+  @tf.function
+  def forward_backward(x, y):
+    # The gradients are returned, otherwise their computation is pruned
+    return gradients(x, y)
+
+  @tf.function
+  def optimizer_step(x, y):
+    loss, grads = gradients(x, y)
+    optimizer.apply_gradients(zip(grads, model.trainable_variables))
+    return loss
+
+  return {'forward': forward, 'forward_backward': forward_backward,
+          'optimizer': optimizer_step}[mode]
+
+def time_steps(step, x, y, nb_steps):
+  """Returns the time of `nb_steps` calls of `step`, until the last one is done."""
+  import tensorflow as tf
+
+  start_time = time.time()
+  for _ in range(nb_steps):
+    outputs = step(x, y)
+  # Reading the outputs waits for the device
+  tf.nest.map_structure(lambda tensor: tensor.numpy(), outputs)
+  return time.time() - start_time
+
+def benchmark(model, mode, batch_size, optimizer, from_logits, warmup_steps=3, nb_steps=10,
+              nb_repetitions=5):
+  """Measures the samples/sec of `mode` steps of `model` on random batches of `batch_size`."""
+  import tensorflow as tf
+
+  x = tf.random.uniform((batch_size,) + tuple(model.input_shape[1:]))
+  y = tf.random.uniform((batch_size,), maxval=10, dtype=tf.int32)
+  step = create_step(model, mode, optimizer, from_logits)
+  time_steps(step, x, y, warmup_steps)
+  samples_per_sec = [batch_size * nb_steps / time_steps(step, x, y, nb_steps)
+                     for _ in range(nb_repetitions)]
+  mean, half_width = confidence_interval(samples_per_sec)
+  # Peaks of the process so far, see batch_probe.py for the peaks of a single batch size
+  peak_rss, peak_device = results.peak_memory()
+  return {'samples_per_sec': mean,
+          'samples_per_sec_ci95': half_width,
+          'step_ms': 1000. * batch_size / mean,
+          'repetitions': samples_per_sec,
+          'peak_rss_mb': peak_rss,
+          'peak_device_mb': peak_device}
+
+def run_benchmarks(flags):
+  """Runs the matrix of `flags` with the thread pools of this process."""
+  import tensorflow as tf
+  from common import precision
+
+  tf.get_logger().setLevel('ERROR')
+  threads.configure_tensorflow(flags)
+  for name in flags.models:
+    for policy in flags.policies:
+      # One model per policy, the layers take the policy when they are built
+      model = build_model(name, policy, flags.image_size, flags.head)
+      optimizer = precision.wrap_optimizer(MODELS[name]['optimizer'])
+      for mode in flags.modes:
+        for batch_size in flags.batch_sizes:
+          config = {'model': name, 'mode': mode, 'batch_size': batch_size, 'policy': policy,
+                    'image_size': flags.image_size if name == 'resnet50' else 32,
+                    'intra_op_threads': flags.intra_op_threads,
+                    'inter_op_threads': flags.inter_op_threads,
+                    'warmup_steps': flags.warmup_steps, 'steps': flags.steps}
+          measures = benchmark(model, mode, batch_size, optimizer, MODELS[name]['from_logits'],
+                               flags.warmup_steps, flags.steps, flags.repetitions)
+          print("Benchmark: " + json.dumps(dict(config, **measures)), flush=True)
+          if flags.results_file:
+            # In the layout of the records of results.py
+            results.append_record(flags.results_file,
+                                  dict(measures, script='benchmark.py', config=config,
+                                       git_revision=results.git_revision()))
+
+def create_arg_parser():
+  parser = argparse.ArgumentParser(description='Microbenchmarks of the models on synthetic data.')
+  parser.add_argument('--models', type=str, nargs='+', choices=sorted(MODELS),
+                    default=sorted(MODELS),
+                    help='Models to benchmark')
+  parser.add_argument('--modes', type=str, nargs='+', choices=MODES, default=MODES,
+                    help='Steps to benchmark: inference, gradients, or whole training steps')
+  parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32, 128],
+                    help='Batch sizes of the steps')
+  parser.add_argument('--policies', type=str, nargs='+', choices=POLICIES,
+                    default=['float32', 'mixed_bfloat16'],
+                    help='Precision policies of the models')
+  parser.add_argument('--image_size', type=int, default=32,
+                    help='Input resolution of ResNet50, the 32x32 images being resized to it')
+  # HEAD_CHOICES of model_factory.py, which imports TensorFlow
+  parser.add_argument('--head', type=str, choices=['flatten', 'gap', 'gmp'], default='flatten',
+                    help='Reduction of the ResNet50 output before its dense head')
+  parser.add_argument('--intra', type=int, nargs='+', default=[0],
+                    help='Sizes of the intra-op pool, 0 for one thread per core')
+  parser.add_argument('--inter', type=int, nargs='+', default=[0],
+                    help='Sizes of the inter-op pool, 0 for the default')
+  parser.add_argument('--warmup_steps', type=int, default=3,
+                    help='Steps run before the measures, the tracing included')
+  parser.add_argument('--steps', type=int, default=10,
+                    help='Steps of a repetition')
+  parser.add_argument('--repetitions', type=int, default=5,
+                    help='Repetitions of every measure, for its confidence interval')
+  parser.add_argument('--results_file', type=str, default='',
+                    help='JSON lines file the measures are appended to, empty for none')
+  parser.add_argument('--worker', type=int, choices=[0,1], default=0,
+                    help=argparse.SUPPRESS)
+  threads.add_thread_arguments(parser)
+  return parser
+
+def main(argv):
+  parser = create_arg_parser()
+  flags = parser.parse_args(args=argv[1:])
+
+  if flags.worker == 1:
+    # A process of a single thread setting, the environment set before TensorFlow is imported
+    threads.configure_environment(argv)
+    run_benchmarks(flags)
+    return
+
+  exit_code = 0
+  for config in threads.candidate_configs(flags.intra, flags.inter, [0]):
+    process = subprocess.run([sys.executable] + argv + ['--worker', '1',
+                             '--intra_op_threads', str(config['intra_op_threads']),
+                             '--inter_op_threads', str(config['inter_op_threads'])])
+    exit_code = exit_code or process.returncode
+  sys.exit(exit_code)
+
+if __name__ == '__main__':
+  main(argv=sys.argv)
@@ -0,0 +1,180 @@
+# Keras callbacks shared by the applications.
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+
+def _percentiles(latencies):
+  """Returns the p50/p95/p99 of `latencies` (seconds) in milliseconds."""
+  if not latencies:
+    return {'step_p50_ms': None, 'step_p95_ms': None, 'step_p99_ms': None}
+  p50, p95, p99 = np.percentile(np.array(latencies) * 1000., [50, 95, 99])
+  return {'step_p50_ms': p50, 'step_p95_ms': p95, 'step_p99_ms': p99}
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+  """Measures the steady-state training throughput.
+
+  Records the latency of every training step, the training time and the
+  samples/sec of every epoch (validation excluded), the time spent in
+  validation and the time to the end of the first step, which is mostly
+  the tracing of the training function. `summary()` returns all of it as a
+  dict, the first epoch being left out of the steady-state figures.
+
+  The tracing and compilation (XLA included) happen in the first step of
+  the training and of the validation: their cost beyond a typical step is
+  reported as the compilation time, the rest of the first epoch as its
+  execution time.
+  """
+
+  def __init__(self, batch_size, nb_samples=None, nb_replicas=1):
+    super(ThroughputCallback, self).__init__()
+    # Global batch, split among `nb_replicas` replicas stepping together
+    self.batch_size = batch_size
+    self.nb_replicas = nb_replicas
+    # Without it the samples of an epoch are counted as full batches
+    self.nb_samples = nb_samples
+    self.epoch_times = []
+    self.validation_times = []
+    self.step_latencies = []
+    self.test_step_latencies = []
+    self.time_to_first_step = None
+    self._train_start = None
+    self._epoch_start = None
+    self._step_start = None
+    self._test_start = None
+    self._test_step_start = None
+
+  def on_train_begin(self, logs=None):
+    self._train_start = time.time()
+
+  def on_epoch_begin(self, epoch, logs=None):
+    self.step_latencies.append([])
+    self._epoch_start = time.time()
+
+  def on_train_batch_begin(self, batch, logs=None):
+    self._step_start = time.time()
+
+  def on_train_batch_end(self, batch, logs=None):
+    # Reading the logs waits for the step to be done on the device
+    if logs:
+      tf.nest.map_structure(lambda value: value.numpy() if hasattr(value, 'numpy') else value, logs)
+    now = time.time()
+    self.step_latencies[-1].append(now - self._step_start)
+    if self.time_to_first_step is None:
+      self.time_to_first_step = now - self._train_start
+
+  def on_test_begin(self, logs=None):
+    # The validation runs at the end of the epoch
+    self._end_epoch()
+    self._test_start = time.time()
+
+  def on_test_batch_begin(self, batch, logs=None):
+    self._test_step_start = time.time()
+
+  def on_test_batch_end(self, batch, logs=None):
+    if logs:
+      tf.nest.map_structure(lambda value: value.numpy() if hasattr(value, 'numpy') else value, logs)
+    self.test_step_latencies.append(time.time() - self._test_step_start)
+
+  def on_test_end(self, logs=None):
+    if self._test_start is not None:
+      self.validation_times.append(time.time() - self._test_start)
+      self._test_start = None
+
+  def on_epoch_end(self, epoch, logs=None):
+    self._end_epoch()
+
+  def _end_epoch(self):
+    if self._epoch_start is not None:
+      self.epoch_times.append(time.time() - self._epoch_start)
+      self._epoch_start = None
+
+  def samples_per_epoch(self, epoch):
+    if self.nb_samples is not None:
+      return self.nb_samples
+    return len(self.step_latencies[epoch]) * self.batch_size
+
+  def compilation(self):
+    """Splits the first epoch into the compilation time and the execution time."""
+    def first_step_overhead(latencies):
+      if not latencies:
+        return None
+      typical = float(np.median(latencies[1:])) if len(latencies) > 1 else 0.
+      return max(0., latencies[0] - typical)
+
+    train_latencies = [latency for latencies in self.step_latencies for latency in latencies]
+    compile_time = first_step_overhead(train_latencies)
+    return {'train_compile_time': compile_time,
+            'test_compile_time': first_step_overhead(self.test_step_latencies),
+            'first_epoch_execution_time': (self.epoch_times[0] - compile_time
+                                           if self.epoch_times and compile_time is not None
+                                           else None)}
+
+  def summary(self):
+    """Returns the measures as a JSON-serializable dict."""
+    epochs = []
+    for epoch, epoch_time in enumerate(self.epoch_times):
+      measures = {'epoch': epoch,
+                  'train_time': epoch_time,
+                  'steps': len(self.step_latencies[epoch]),
+                  'samples_per_sec': self.samples_per_epoch(epoch) / epoch_time}
+      measures.update(_percentiles(self.step_latencies[epoch]))
+      epochs.append(measures)
+
+    # The first epoch includes the tracing, unless it is the only one
+    first = 1 if len(self.epoch_times) > 1 else 0
+    steady_samples = sum(self.samples_per_epoch(epoch)
+                         for epoch in range(first, len(self.epoch_times)))
+    steady_time = sum(self.epoch_times[first:])
+    steady_state = {'samples_per_sec': steady_samples / steady_time if steady_time else None}
+    # The replicas step together, a step latency is the step time of every replica
+    steady_state['samples_per_sec_per_replica'] = (steady_state['samples_per_sec'] / self.nb_replicas
+                                                   if steady_state['samples_per_sec'] else None)
+    steady_state.update(_percentiles([latency for latencies in self.step_latencies[first:]
+                                      for latency in latencies]))
+
+    return {'batch_size': self.batch_size,
+            'nb_replicas': self.nb_replicas,
+            'replica_batch_size': self.batch_size // self.nb_replicas,
+            'time_to_first_step': self.time_to_first_step,
+            'validation_time': sum(self.validation_times),
+            'compilation': self.compilation(),
+            'epochs': epochs,
+            'steady_state': steady_state}
+
+  def on_train_end(self, logs=None):
+    print("Throughput: " + json.dumps(self.summary()))
+
+class _StepTimer(tf.keras.callbacks.Callback):
+  """Records the latency of the training steps, with nothing printed."""
+
+  def __init__(self):
+    super(_StepTimer, self).__init__()
+    self.step_latencies = []
+    self._step_start = None
+
+  def on_train_batch_begin(self, batch, logs=None):
+    self._step_start = time.time()
+
+  def on_train_batch_end(self, batch, logs=None):
+    if logs:
+      tf.nest.map_structure(lambda value: value.numpy() if hasattr(value, 'numpy') else value, logs)
+    self.step_latencies.append(time.time() - self._step_start)
+
+def measure_input_wait(model, ds, step_ms, nb_steps=20):
+  """Returns the share of the training step time `step_ms` spent waiting on `ds`.
+
+  Runs `nb_steps` more training steps on the first batch of `ds` repeated
+  from memory: the step time without input pipeline, the difference with
+  `step_ms` being the wait on the input. These steps train the model on
+  this batch, to be run once the model is evaluated.
+  """
+  timer = _StepTimer()
+  model.fit(ds.take(1).cache().repeat(), epochs=1, steps_per_epoch=nb_steps,
+            callbacks=[timer], verbose=0)
+  # The first step fills the cache
+  compute_ms = float(np.median(timer.step_latencies[1:] or timer.step_latencies)) * 1000.
+  return {'step_ms': step_ms,
+          'compute_step_ms': compute_ms,
+          'input_wait_pct': 100. * max(0., step_ms - compute_ms) / step_ms if step_ms else None}
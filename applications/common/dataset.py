@@ -0,0 +1,132 @@
+# Shared CIFAR-10 loading for the CNN and ResNet50 applications.
+#
+# The training set is subsampled with a single index array on the original
+# uint8 arrays: no per-row Python objects and no intermediate DataFrame.
+#
+# The Keras datasets are converted once into raw .npy files which are then
+# opened memory-mapped, so repeated runs skip the unpickling and concurrent
+# runs of a sweep share the same page-cache pages.
+# Run `python dataset.py cifar10 fashion_mnist mnist` to fill the cache.
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from tensorflow.keras import datasets
+from tensorflow.keras.layers.experimental import preprocessing
+
+# Number of samples in the CIFAR-10 training set
+NB_SAMPLES = 50000
+
+# Directory of the .npy cache, next to the Keras download cache by default
+CACHE_DIR = os.environ.get('DATASET_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.keras', 'datasets', 'npy'))
+
+DATASETS = {'cifar10': datasets.cifar10,
+            'fashion_mnist': datasets.fashion_mnist,
+            'mnist': datasets.mnist}
+
+# Where pixels are scaled to [0, 1]: in NumPy on the host (float arrays),
+# or inside the graph, the training arrays then staying uint8 in host memory
+NORMALIZATION_CHOICES = ['host', 'graph']
+
+_ARRAY_NAMES = ['train_images', 'train_labels', 'test_images', 'test_labels']
+
+CLASS_NAMES = ['airplane', 'automobile', 'bird', 'cat', 'deer',
+               'dog', 'frog', 'horse', 'ship', 'truck']
+
+def sample_subset(images, labels, nb_samples, seed=None):
+  """Selects `nb_samples` random rows of `images` and `labels`.
+
+  When the whole set is requested the arrays are returned as they are
+  (no copy): `model.fit` reshuffles them at every epoch anyway.
+  """
+  nb_total = images.shape[0]
+  if nb_samples is None or nb_samples >= nb_total:
+    return images, labels
+
+  rng = np.random.default_rng(seed)
+  index = rng.choice(nb_total, size=nb_samples, replace=False)
+  # Gather in memory order, the order itself is irrelevant for training
+  index.sort()
+  return images[index], labels[index]
+
+def normalize(images):
+  """Scales `uint8` pixel values to float32 values between 0 and 1."""
+  images = images.astype(np.float32)
+  images /= 255.0
+  return images
+
+def _cache_paths(name, cache_dir):
+  return [os.path.join(cache_dir, name + '_' + array_name + '.npy')
+          for array_name in _ARRAY_NAMES]
+
+def convert_dataset(name, cache_dir=CACHE_DIR):
+  """Writes the arrays of the Keras dataset `name` as .npy files, once."""
+  paths = _cache_paths(name, cache_dir)
+  if all(os.path.exists(path) for path in paths):
+    return paths
+
+  print("Converting " + name + " into " + cache_dir)
+  os.makedirs(cache_dir, exist_ok=True)
+  (train_images, train_labels), (test_images, test_labels) = DATASETS[name].load_data()
+  arrays = [train_images, train_labels, test_images, test_labels]
+  for path, array in zip(paths, arrays):
+    # Write then rename, so that a concurrent run never opens a partial file
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+  return paths
+
+def load_dataset(name, cache_dir=CACHE_DIR):
+  """Returns the train and test arrays of `name`, memory-mapped read-only."""
+  paths = convert_dataset(name, cache_dir)
+  return tuple(np.load(path, mmap_mode='r') for path in paths)
+
+def rescaling_layer(**kwargs):
+  """Returns the layer scaling `uint8` pixel values to [0, 1] inside the model."""
+  return preprocessing.Rescaling(1. / 255, **kwargs)
+
+def load_cifar10(nb_samples=NB_SAMPLES, seed=None, cache_dir=CACHE_DIR):
+  """Loads CIFAR-10 and keeps `nb_samples` random training samples.
+
+  Images are returned as `uint8`, labels as int arrays of shape (N, 1).
+  """
+  train_images, train_labels, test_images, test_labels = load_dataset('cifar10', cache_dir)
+  print("There are " + str(train_images.shape[0]) + " training samples")
+
+  train_images, train_labels = sample_subset(train_images, train_labels,
+                                             nb_samples, seed)
+  print("There are " + str(train_images.shape[0]) + " training samples")
+
+  return (train_images, train_labels, test_images, test_labels)
+
+def add_dataset_arguments(parser):
+  """Adds the dataset options shared by the applications to `parser`."""
+  parser.add_argument('--nb_samples', type=int, default=NB_SAMPLES,
+                    help='Number of training samples drawn from the 50000 of CIFAR-10')
+  parser.add_argument('--seed', type=int, default=None,
+                    help='Seed of the training subset sampling')
+  parser.add_argument('--cache_dir', type=str, default=CACHE_DIR,
+                    help='Directory of the memory-mapped .npy dataset cache')
+  parser.add_argument('--normalization', type=str, choices=NORMALIZATION_CHOICES,
+                    default='host', required=False,
+                    help='Scaling the pixels on the host (float arrays) or in the graph (uint8 arrays)')
+  return parser
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Converting the datasets into .npy files.')
+  parser.add_argument('names', nargs='+', choices=sorted(DATASETS),
+                    help='Datasets to convert')
+  parser.add_argument('--cache_dir', type=str, default=CACHE_DIR,
+                    help='Directory of the memory-mapped .npy dataset cache')
+  flags = parser.parse_args(args=argv[1:])
+
+  for name in flags.names:
+    for path in convert_dataset(name, flags.cache_dir):
+      print(path)
+
+if __name__ == '__main__':
+  main(argv=sys.argv)
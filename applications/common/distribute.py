@@ -0,0 +1,107 @@
+# Data-parallel training with tf.distribute.
+#
+# --strategy selects how the training step is replicated:
+#   default       the single default device
+#   mirrored      MirroredStrategy over the GPUs, or without GPU over
+#                 --nb_replicas logical CPU devices splitting the host
+#   multi_worker  MultiWorkerMirroredStrategy, one replica per process,
+#                 the processes started by this module (see main())
+# --batch_size is the batch of one replica, the global batch being
+# --batch_size times the number of replicas. The step latencies measured
+# by ThroughputCallback are then the step time of every replica, which
+# gives the scaling efficiency against a run with the default strategy.
+#
+# Example, two localhost workers from applications/cnn:
+#   python3 ../common/distribute.py --workers 2 app_cnn.py --batch_size 64 --strategy multi_worker
+import os
+import sys
+import json
+import socket
+import argparse
+import subprocess
+
+import tensorflow as tf
+
+STRATEGY_CHOICES = ['default', 'mirrored', 'multi_worker']
+
+def configure_cpu_devices(nb_devices):
+  """Splits the host CPU into `nb_devices` logical devices.
+
+  Must run before TensorFlow initializes its devices, the logical devices
+  share the thread pools of the host.
+  """
+  cpu = tf.config.list_physical_devices('CPU')[0]
+  if len(tf.config.get_logical_device_configuration(cpu) or []) == nb_devices:
+    return
+  tf.config.set_logical_device_configuration(
+      cpu, [tf.config.LogicalDeviceConfiguration() for _ in range(nb_devices)])
+
+def create_strategy(name='default', nb_replicas=2):
+  """Returns the distribution strategy of the --strategy option."""
+  if name == 'mirrored':
+    if tf.config.list_physical_devices('GPU'):
+      return tf.distribute.MirroredStrategy()
+    configure_cpu_devices(nb_replicas)
+    devices = [device.name for device in tf.config.list_logical_devices('CPU')]
+    # NCCL, the default all-reduce, needs GPUs
+    return tf.distribute.MirroredStrategy(devices=devices,
+                                          cross_device_ops=tf.distribute.ReductionToOneDevice())
+  if name == 'multi_worker':
+    # The cluster is described by TF_CONFIG
+    return tf.distribute.MultiWorkerMirroredStrategy()
+  return tf.distribute.get_strategy()
+
+def global_batch_size(batch_size, strategy):
+  """Returns the global batch of `batch_size` samples per replica."""
+  return batch_size * strategy.num_replicas_in_sync
+
+def is_chief(strategy):
+  """True but on the non-chief workers of a multi-worker run, which write no logs nor results."""
+  resolver = getattr(strategy, 'cluster_resolver', None)
+  if resolver is None or not resolver.task_type:
+    return True
+  return resolver.task_type == 'chief' or (resolver.task_type == 'worker' and resolver.task_id == 0)
+
+def add_strategy_arguments(parser):
+  """Adds the distribution options to `parser`."""
+  parser.add_argument('--strategy', type=str, choices=STRATEGY_CHOICES, default='default',
+                    help='Distribution strategy: the default device, MirroredStrategy over the GPUs '
+                         'or logical CPU devices, or MultiWorkerMirroredStrategy')
+  parser.add_argument('--nb_replicas', type=int, default=2,
+                    help='Number of logical CPU devices of the mirrored strategy without GPU')
+  return parser
+
+def _free_port():
+  with socket.socket() as s:
+    s.bind(('localhost', 0))
+    return s.getsockname()[1]
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Running an application on localhost workers.')
+  parser.add_argument('--workers', type=int, default=2,
+                    help='Number of worker processes')
+  parser.add_argument('--pin', type=int, choices=[0,1], default=1,
+                    help='Pinning every worker to its own share of the CPU cores')
+  parser.add_argument('command', nargs=argparse.REMAINDER,
+                    help='Application and its options, --strategy multi_worker included')
+  flags = parser.parse_args(args=argv[1:])
+  if not flags.command:
+    parser.error('No application to run')
+
+  workers = ['localhost:%d' % _free_port() for _ in range(flags.workers)]
+  cores = sorted(os.sched_getaffinity(0))
+  cores_per_worker = max(1, len(cores) // flags.workers)
+  processes = []
+  for index in range(flags.workers):
+    env = dict(os.environ)
+    env['TF_CONFIG'] = json.dumps({'cluster': {'worker': workers},
+                                   'task': {'type': 'worker', 'index': index}})
+    worker_cores = cores[index * cores_per_worker:(index + 1) * cores_per_worker] or cores
+    preexec_fn = (lambda worker_cores=worker_cores: os.sched_setaffinity(0, worker_cores)) \
+        if flags.pin == 1 else None
+    processes.append(subprocess.Popen([sys.executable] + flags.command, env=env,
+                                      preexec_fn=preexec_fn))
+  sys.exit(max(process.wait() for process in processes))
+
+if __name__ == '__main__':
+  main(argv=sys.argv)
@@ -0,0 +1,56 @@
+# On-disk cache of the features of a frozen backbone.
+#
+# When only the head of a transfer-learning model is trained, the backbone
+# gives the same features for an image at every epoch. They are computed
+# once, streamed batch by batch into a .npy file and then opened
+# memory-mapped to train the head. A cache file is keyed by the weights of
+# the backbone, the input resolution, the precision policy and the images,
+# so that a change in any of them computes the features again.
+import os
+import hashlib
+
+import numpy as np
+
+from common import dataset
+
+FEATURE_CACHE_DIR = os.path.join(dataset.CACHE_DIR, 'features')
+
+def _hash_arrays(arrays):
+  digest = hashlib.sha1()
+  for array in arrays:
+    digest.update(str(array.shape).encode())
+    digest.update(np.ascontiguousarray(array).data)
+  return digest.hexdigest()
+
+def cache_key(backbone, image_size, precision):
+  """Returns the key of the features of `backbone`, independent of the images."""
+  weights_hash = _hash_arrays(backbone.get_weights())
+  return '%s_%d_%s_%s' % (backbone.name, image_size, precision, weights_hash[:16])
+
+def extract_features(extractor, images, path, batch_size):
+  """Runs `extractor` over `images` and streams the outputs into the .npy file `path`."""
+  tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+  features = None
+  for start in range(0, len(images), batch_size):
+    batch = np.asarray(extractor.predict_on_batch(images[start:start + batch_size]))
+    if features is None:
+      features = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=batch.dtype,
+                                           shape=(len(images),) + batch.shape[1:])
+    features[start:start + len(batch)] = batch
+  features.flush()
+  del features
+  # Renamed once complete, a concurrent run never opens a partial file
+  os.replace(tmp_path, path)
+
+def load_features(extractor, images, key, batch_size, cache_dir=FEATURE_CACHE_DIR):
+  """Returns the features of `images`, memory-mapped, computing them if not cached.
+
+  `key` identifies the extractor (see `cache_key()`), the images are
+  hashed into the file name.
+  """
+  os.makedirs(cache_dir, exist_ok=True)
+  path = os.path.join(cache_dir, key + '_' + _hash_arrays([images])[:16] + '.npy')
+  if not os.path.exists(path):
+    print("Computing the features into " + path)
+    extract_features(extractor, images, path, batch_size)
+  return np.load(path, mmap_mode='r')
@@ -0,0 +1,77 @@
+# Batched inference of a trained model.
+#
+# model.predict() builds a new data adapter and its predict function on
+# every call, which dominates the latency of small batches such as a single
+# image. BatchPredictor traces the forward pass once as a tf.function over
+# batches of any size, warms it up, then serves the predictions in batches
+# of a fixed size. `measure_latency()` times it for a range of batch sizes,
+# from the single sample to large batches, and `measure_predict_latency()`
+# times model.predict() on the same batches for comparison.
+import time
+
+import numpy as np
+import tensorflow as tf
+
+BATCH_SIZES = [1, 8, 64, 512]
+
+class BatchPredictor:
+  """Serves the predictions of `model` in batches of `batch_size` samples."""
+
+  def __init__(self, model, batch_size=64, dtype=tf.float32):
+    self.model = model
+    self.batch_size = batch_size
+    self.dtype = dtype
+    input_shape = tuple(model.input_shape[1:])
+    # A single trace for every batch size
+    self._forward = tf.function(lambda images: model(images, training=False),
+                                input_signature=[tf.TensorSpec((None,) + input_shape, dtype)])
+
+  def warmup(self, images, nb_steps=2):
+    """Runs a few batches so that the tracing is not in the first measure."""
+    for _ in range(nb_steps):
+      self.predict_batch(images[:self.batch_size])
+
+  def predict_batch(self, images):
+    """Returns the predictions of one batch as a NumPy array."""
+    return self._forward(tf.convert_to_tensor(images, dtype=self.dtype)).numpy()
+
+  def predict(self, images):
+    """Returns the predictions of `images`, computed `batch_size` at a time."""
+    outputs = [self.predict_batch(images[start:start + self.batch_size])
+               for start in range(0, len(images), self.batch_size)]
+    return np.concatenate(outputs)
+
+def _measure(predict, images, batch_sizes, nb_runs, path):
+  measures = []
+  for batch_size in batch_sizes:
+    batch = images[:batch_size]
+    # Warm-up, also of the kernels of this batch size
+    predict(batch)
+    latencies = []
+    for _ in range(nb_runs):
+      start_time = time.time()
+      predict(batch)
+      latencies.append(time.time() - start_time)
+    p50, p95 = (float(value) for value in np.percentile(np.array(latencies) * 1000., [50, 95]))
+    measures.append({'path': path,
+                     'batch_size': len(batch),
+                     'p50_ms': p50,
+                     'p95_ms': p95,
+                     'per_sample_ms': p50 / len(batch),
+                     'samples_per_sec': len(batch) / (p50 / 1000.)})
+  return measures
+
+def measure_latency(predictor, images, batch_sizes=BATCH_SIZES, nb_runs=20):
+  """Times `predictor.predict()` on batches of `images` of each of `batch_sizes`.
+
+  Returns one dict per batch size: the p50/p95 latency of a batch in ms,
+  the latency per sample and the samples/sec. A batch over the batch size
+  of the predictor is served in several calls, as predict() does.
+  """
+  return _measure(predictor.predict, images, batch_sizes, nb_runs, 'BatchPredictor')
+
+def measure_predict_latency(model, images, batch_sizes=BATCH_SIZES, nb_runs=20):
+  """Times model.predict() as `measure_latency()` times a predictor, the baseline."""
+  def predict(batch):
+    return model.predict(batch, batch_size=len(batch), verbose=0)
+  return _measure(predict, images, batch_sizes, nb_runs, 'model.predict')
@@ -0,0 +1,116 @@
+# Models of the applications, built from declarative configurations.
+#
+# A model configuration is a dict: its name, the input shape, the precision
+# policy and the list of its layers, each one given as the name of a Keras
+# layer and its arguments. The CNN and the ResNet50 head are described here
+# once, their widths being parameters, instead of being copied in every
+# script.
+#
+# The last layer of every model is kept in float32 whatever the policy, see
+# precision.py.
+#
+# A process running several configurations back to back builds a model
+# once: `cached_model()` keeps the built models with their initial weights
+# and resets the weights when a model is asked again.
+import json
+
+from tensorflow.keras import layers, models
+from tensorflow.keras.layers.experimental import preprocessing
+
+from common import precision
+
+# Layer reducing the ResNet50 feature map (8x8x2048 at 256x256) before the dense head
+HEAD_LAYERS = {'flatten': 'Flatten',
+               'gap': 'GlobalAveragePooling2D',
+               'gmp': 'GlobalMaxPooling2D'}
+HEAD_CHOICES = sorted(HEAD_LAYERS)
+
+# Built models of this process with their initial weights
+_MODELS = {}
+
+def cnn_layers(filters=(32, 64, 64), dense_units=64, nb_classes=10, normalization='host'):
+  """Returns the layers of the CNN of the TensorFlow tutorial.
+
+  A 3x3 convolution per entry of `filters`, with a max pooling between two
+  of them, then a dense layer and the logits.
+  """
+  specs = []
+  if normalization == 'graph':
+    # The images stay uint8 on the host and are scaled on the device
+    specs.append(('Rescaling', {'scale': 1. / 255}))
+  for i, nb_filters in enumerate(filters):
+    if i > 0:
+      specs.append(('MaxPooling2D', {'pool_size': (2, 2)}))
+    specs.append(('Conv2D', {'filters': nb_filters, 'kernel_size': (3, 3), 'activation': 'relu'}))
+  specs.append(('Flatten', {}))
+  specs.append(('Dense', {'units': dense_units, 'activation': 'relu'}))
+  # Logits in float32, for a numerically safe loss under float16
+  specs.append(('Dense', {'units': nb_classes, 'dtype': 'float32'}))
+  return specs
+
+def cnn_config(normalization='host', policy='float32', **widths):
+  """Returns the configuration of the CNN on the 32x32 CIFAR-10 images."""
+  return {'name': 'cnn',
+          'input_shape': (32, 32, 3),
+          'policy': policy,
+          'layers': cnn_layers(normalization=normalization, **widths)}
+
+def resnet50_head_layers(head='flatten', units=(128, 64), dropout=0.5, nb_classes=10):
+  """Returns the layers of the classifier trained on top of ResNet50."""
+  specs = [(HEAD_LAYERS[head], {})]
+  for nb_units in units:
+    specs.append(('BatchNormalization', {}))
+    specs.append(('Dense', {'units': nb_units, 'activation': 'relu'}))
+    specs.append(('Dropout', {'rate': dropout}))
+  specs.append(('BatchNormalization', {}))
+  # Softmax in float32, for a numerically safe loss under float16
+  specs.append(('Dense', {'units': nb_classes, 'activation': 'softmax', 'dtype': 'float32'}))
+  return specs
+
+def build_layers(specs):
+  """Returns the Keras layers of a list of (layer name, arguments) specs."""
+  built = []
+  for name, kwargs in specs:
+    layer_class = getattr(layers, name, None) or getattr(preprocessing, name)
+    built.append(layer_class(**kwargs))
+  return built
+
+def create_model(config):
+  """Builds the Sequential model of `config` under its precision policy."""
+  precision.set_policy(config.get('policy', 'float32'))
+  model = models.Sequential(name=config.get('name'))
+  model.add(layers.InputLayer(input_shape=config['input_shape']))
+  for layer in build_layers(config['layers']):
+    model.add(layer)
+
+  # print the architecture
+  model.summary()
+  return model
+
+def cached_model(key, build_fn):
+  """Returns the model built by `build_fn()`, built once per `key` in the process.
+
+  A model asked again gets its initial weights back, it has to be compiled
+  again for a fresh optimizer.
+  """
+  if key in _MODELS:
+    model, initial_weights = _MODELS[key]
+    model.set_weights(initial_weights)
+    return model
+  model = build_fn()
+  _MODELS[key] = (model, model.get_weights())
+  return model
+
+def get_model(config, strategy=None):
+  """Returns the model of `config`, built once per process and strategy.
+
+  The model is built in the scope of the distribution `strategy` if given.
+  """
+  if strategy is None:
+    return cached_model(json.dumps(config, sort_keys=True), lambda: create_model(config))
+
+  def build():
+    with strategy.scope():
+      return create_model(config)
+  key = (json.dumps(config, sort_keys=True), type(strategy).__name__, strategy.num_replicas_in_sync)
+  return cached_model(key, build)
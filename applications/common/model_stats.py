@@ -0,0 +1,65 @@
+# Parameter counts and FLOP estimates of the Keras models.
+#
+# The FLOPs are counted analytically per sample of the forward pass, a
+# multiply-add counting as 2 FLOPs, for the layers doing the arithmetic:
+# convolutions, dense layers, batch normalization, pooling and additions.
+# Activations, dropout and reshapes are left out, so the figure is an
+# estimate meant to compare the variants of a model, not a measure.
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+
+def _size(shape):
+  """Number of elements of one sample of a tensor of shape `shape`."""
+  return int(np.prod([int(dim) for dim in shape[1:]]))
+
+def _shapes(tensors):
+  if isinstance(tensors, (list, tuple)):
+    return [tensor.shape for tensor in tensors]
+  return [tensors.shape]
+
+def layer_flops(layer):
+  """Returns the estimated forward FLOPs of `layer` for one sample."""
+  if isinstance(layer, tf.keras.Model):
+    return model_flops(layer)
+  if isinstance(layer, layers.InputLayer):
+    return 0
+  input_shapes = _shapes(layer.input)
+  output_size = _size(_shapes(layer.output)[0])
+  if isinstance(layer, layers.DepthwiseConv2D):
+    return 2 * int(np.prod(layer.kernel_size)) * output_size
+  if isinstance(layer, layers.Conv2D):
+    input_channels = int(input_shapes[0][-1]) // getattr(layer, 'groups', 1)
+    return 2 * int(np.prod(layer.kernel_size)) * input_channels * output_size
+  if isinstance(layer, layers.Dense):
+    return 2 * int(input_shapes[0][-1]) * output_size
+  if isinstance(layer, layers.BatchNormalization):
+    # Scale and shift, once folded at inference
+    return 2 * output_size
+  if isinstance(layer, (layers.MaxPooling2D, layers.AveragePooling2D)):
+    return int(np.prod(layer.pool_size)) * output_size
+  if isinstance(layer, (layers.GlobalMaxPooling2D, layers.GlobalAveragePooling2D)):
+    return _size(input_shapes[0])
+  if isinstance(layer, layers.Add):
+    return (len(input_shapes) - 1) * output_size
+  return 0
+
+def model_flops(model):
+  """Returns the estimated forward FLOPs of `model` for one sample."""
+  return sum(layer_flops(layer) for layer in model.layers)
+
+def layers_stats(model_layers):
+  """Returns the parameter counts and the FLOP estimate of a list of built layers.
+
+  Training (forward and backward) is counted as 3 times the forward FLOPs.
+  """
+  trainable = sum(tf.keras.backend.count_params(w) for layer in model_layers
+                  for w in layer.trainable_weights)
+  non_trainable = sum(tf.keras.backend.count_params(w) for layer in model_layers
+                      for w in layer.non_trainable_weights)
+  flops = sum(layer_flops(layer) for layer in model_layers)
+  return {'params': trainable + non_trainable,
+          'trainable_params': trainable,
+          'non_trainable_params': non_trainable,
+          'forward_flops': flops,
+          'train_flops': 3 * flops}
@@ -0,0 +1,160 @@
+# tf.data input pipelines shared by the applications.
+#
+# The batch size, the shuffle buffer, the cache location (memory or file)
+# and the position of cache() relative to map() and batch() are parameters,
+# so that the pipeline orderings can be compared with each other.
+#
+# The random augmentation uses stateless random ops seeded per element (see
+# with_seeds()), so that a seeded pipeline gives the same samples whatever
+# the thread running the parallel map() of an element.
+import math
+
+import tensorflow as tf
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+# Where cache() is inserted in the pipeline, 'none' for no cache at all
+CACHE_POSITIONS = ['none', 'before_map', 'after_map', 'after_batch']
+
+# Input pipelines compared by --input_pipeline, 'numpy' feeds the arrays
+# to model.fit directly and the others are build_pipeline() options
+INPUT_PIPELINES = {
+  'tfdata': dict(cache_position='none', prefetch=False, num_parallel_calls=None),
+  'tfdata_cache': dict(cache_position='after_batch', prefetch=False, num_parallel_calls=None),
+  'tfdata_prefetch': dict(cache_position='after_batch', prefetch=True, num_parallel_calls=AUTOTUNE),
+}
+INPUT_PIPELINE_CHOICES = ['numpy'] + list(INPUT_PIPELINES)
+
+# Augmentation of resnet50.py: RandomFlip("horizontal"), RandomRotation(0.1), RandomZoom(0.1)
+ROTATION_FACTOR = 0.1
+ZOOM_FACTOR = 0.1
+
+def normalize_img(image, label):
+  """Normalizes images: `uint8` -> `float32`."""
+  return tf.cast(image, tf.float32) / 255., label
+
+def resize_img(image_size, normalize=True):
+  """Returns the map() function resizing the images to `image_size` pixels.
+
+  The images are scaled to [0, 1] first when `normalize` is set.
+  """
+  def resize(image, label):
+    if normalize:
+      image, label = normalize_img(image, label)
+    return tf.image.resize(image, (image_size, image_size), method='nearest'), label
+  return resize
+
+def with_seeds(ds, seed=None):
+  """Pairs every element of `ds` with the [2] seed of its random ops.
+
+  The seeds are drawn in order from `seed`, None for different seeds on
+  every run.
+  """
+  # Dataset.random() from TF 2.6
+  random = getattr(tf.data.Dataset, 'random', None) or tf.data.experimental.RandomDataset
+  return tf.data.Dataset.zip((ds, random(seed=seed).batch(2)))
+
+def _rotate_and_zoom(image, angle, scale):
+  # Output pixel (x, y) sampled at the input pixel rotated by `angle` and
+  # scaled by `scale` around the center
+  height = tf.cast(tf.shape(image)[0], tf.float32)
+  width = tf.cast(tf.shape(image)[1], tf.float32)
+  cx, cy = (width - 1.) / 2., (height - 1.) / 2.
+  cos, sin = scale * tf.cos(angle), scale * tf.sin(angle)
+  transform = tf.stack([cos, -sin, cx - cos * cx + sin * cy,
+                        sin, cos, cy - sin * cx - cos * cy, 0., 0.])
+  images = tf.raw_ops.ImageProjectiveTransformV2(
+      images=image[tf.newaxis], transforms=transform[tf.newaxis],
+      output_shape=tf.shape(image)[:2], interpolation='BILINEAR', fill_mode='REFLECT')
+  return images[0]
+
+def augment_img(map_fn=None, rotation=ROTATION_FACTOR, zoom=ZOOM_FACTOR):
+  """Returns the map() function of a random flip, rotation and zoom.
+
+  It takes the elements of with_seeds(). The rotation is up to `rotation`
+  of a full turn, the zoom up to `zoom` in or out. `map_fn` (the resize,
+  the normalization) follows in the same map(), on the augmented image:
+  augmenting the 32x32 images before their resize is the cheapest.
+  """
+  def augment(sample, seed):
+    image, label = sample
+    seeds = tf.random.experimental.stateless_split(seed, 3)
+    image = tf.image.stateless_random_flip_left_right(image, seeds[0])
+    angle = tf.random.stateless_uniform([], seeds[1], -rotation, rotation) * 2. * math.pi
+    scale = 1. + tf.random.stateless_uniform([], seeds[2], -zoom, zoom)
+    image = _rotate_and_zoom(image, angle, scale)
+    if map_fn is not None:
+      return map_fn(image, label)
+    return image, label
+  return augment
+
+def with_private_threads(ds, nb_threads):
+  """Runs `ds` on its own pool of `nb_threads` threads, 0 to share the inter-op pool."""
+  if nb_threads <= 0:
+    return ds
+  options = tf.data.Options()
+  # options.threading from TF 2.6
+  threading = getattr(options, 'threading', None) or options.experimental_threading
+  threading.private_threadpool_size = nb_threads
+  return ds.with_options(options)
+
+def build_pipeline(ds, batch_size, shuffle_buffer=0, cache_position='after_batch',
+                   cache_file='', map_fn=normalize_img, prefetch=True,
+                   num_parallel_calls=AUTOTUNE, private_threads=0):
+  """Batches `ds` and applies `map_fn`, cache, shuffle and prefetch to it.
+
+  An empty `cache_file` caches in memory, otherwise in files with this prefix.
+  The shuffle is placed after the cache so that it is redone at every epoch:
+  it shuffles samples when the cache comes before batch(), whole batches
+  otherwise. A `shuffle_buffer` of 0 keeps the original order.
+  `num_parallel_calls=None` runs `map_fn` sequentially. With
+  `private_threads` the pipeline runs on its own thread pool.
+  """
+  def cache_and_shuffle(ds, position, nb_elements):
+    if cache_position == position:
+      ds = ds.cache(cache_file)
+    if shuffle_buffer > 0 and position == shuffle_position:
+      ds = ds.shuffle(max(1, shuffle_buffer // nb_elements))
+    return ds
+
+  # The shuffle goes right after the cache, or before batch() without cache
+  shuffle_position = 'after_map' if cache_position in ['none', 'before_map'] else cache_position
+
+  ds = cache_and_shuffle(ds, 'before_map', 1)
+  if map_fn is not None:
+    ds = ds.map(map_fn, num_parallel_calls=num_parallel_calls)
+  ds = cache_and_shuffle(ds, 'after_map', 1)
+  ds = ds.batch(batch_size)
+  # The buffer is given in samples, after batch() it holds whole batches
+  ds = cache_and_shuffle(ds, 'after_batch', batch_size)
+  if prefetch:
+    ds = ds.prefetch(AUTOTUNE)
+  return with_private_threads(ds, private_threads)
+
+def from_arrays(images, labels, batch_size, input_pipeline, map_fn=normalize_img, private_threads=0,
+                shuffle=False):
+  """Builds the `input_pipeline` dataset of in-memory `images` and `labels`.
+
+  With `shuffle`, for the training set, the samples are reshuffled at every
+  epoch as model.fit() does with the arrays of the numpy pipeline: the
+  cache then comes before batch(), a cache of whole batches would only
+  shuffle the batches.
+  """
+  ds = tf.data.Dataset.from_tensor_slices((images, labels))
+  options = dict(INPUT_PIPELINES[input_pipeline])
+  if shuffle:
+    options['shuffle_buffer'] = len(images)
+    if options['cache_position'] == 'after_batch':
+      options['cache_position'] = 'after_map'
+  return build_pipeline(ds, batch_size, map_fn=map_fn, private_threads=private_threads, **options)
+
+def add_pipeline_arguments(parser):
+  """Adds the tf.data pipeline options to `parser`."""
+  parser.add_argument('--shuffle_buffer', type=int, default=0,
+                    help='Size in samples of the shuffle buffer, 0 for no shuffle')
+  parser.add_argument('--cache_position', type=str, choices=CACHE_POSITIONS,
+                    default='after_batch', required=False,
+                    help='Position of cache() relative to map() and batch()')
+  parser.add_argument('--cache_file', type=str, default='',
+                    help='File prefix of the tf.data cache, empty to cache in memory')
+  return parser
@@ -0,0 +1,52 @@
+# Precision policies of the applications.
+#
+# --mixed_precision 1 selects the policy of --policy_type: 16 for
+# mixed_float16, bf16 for mixed_bfloat16, 32 for float32. Without
+# --mixed_precision the models run in float32. mixed_float16 only pays off
+# on GPUs with float16 units, while mixed_bfloat16 is the mixed policy of
+# the CPUs with bfloat16 instructions (and of TPUs).
+#
+# float16 gradients underflow without loss scaling, so the optimizer is
+# wrapped in a LossScaleOptimizer under mixed_float16. bfloat16 has the
+# range of float32 and needs no scaling. model.fit() scales the loss
+# itself, the custom training steps through scale_loss() and
+# unscale_gradients(). The output layers of the models are kept in float32
+# (see model_factory.py) so that the softmax and the loss are computed in
+# float32 under every policy.
+import tensorflow as tf
+from tensorflow.keras import mixed_precision
+
+# --policy_type values
+POLICY_TYPES = {'16': 'mixed_float16', '32': 'float32', 'bf16': 'mixed_bfloat16'}
+POLICY_TYPE_CHOICES = sorted(POLICY_TYPES)
+
+def policy_name(mixed_precision_mode=0, policy_type='16'):
+  """Returns the precision policy of the --mixed_precision and --policy_type options."""
+  if mixed_precision_mode == 1:
+    return POLICY_TYPES[str(policy_type)]
+  return 'float32'
+
+def set_policy(name):
+  """Sets the global precision policy, the layers take it when they are built."""
+  mixed_precision.set_global_policy(name)
+  return mixed_precision.global_policy()
+
+def wrap_optimizer(optimizer):
+  """Returns `optimizer`, a name or an instance, with loss scaling under mixed_float16."""
+  optimizer = tf.keras.optimizers.get(optimizer)
+  if (mixed_precision.global_policy().name == 'mixed_float16'
+      and not isinstance(optimizer, mixed_precision.LossScaleOptimizer)):
+    optimizer = mixed_precision.LossScaleOptimizer(optimizer)
+  return optimizer
+
+def scale_loss(optimizer, loss):
+  """Returns `loss` scaled by the loss scale of `optimizer`, for the gradients of a custom step."""
+  if isinstance(optimizer, mixed_precision.LossScaleOptimizer):
+    return optimizer.get_scaled_loss(loss)
+  return loss
+
+def unscale_gradients(optimizer, gradients):
+  """Returns the `gradients` of a scaled loss divided back by the loss scale."""
+  if isinstance(optimizer, mixed_precision.LossScaleOptimizer):
+    return optimizer.get_unscaled_gradients(gradients)
+  return gradients
@@ -0,0 +1,135 @@
+# Profiler windows of the training runs.
+#
+# The TensorBoard callback only takes one fixed range of steps, which an
+# epoch of a large batch size may never reach. Here a run takes several
+# windows, each one given as:
+#   A-B       the global training steps A to B (counted from 0, included)
+#   warmup:N  the first N steps, tracing included
+#   steady:N  N steps in the middle of the second epoch (of the only one
+#             when training for a single epoch)
+#   epoch:E   the whole epoch E (counted from 1, as Keras prints them)
+# Every window is written as its own profile run under the log directory.
+import re
+import argparse
+
+import tensorflow as tf
+
+DEFAULT_WINDOWS = ['steady:20']
+
+_WINDOW = re.compile(r'^(?:(\d+)-(\d+)|(warmup|steady|epoch):(\d+))$')
+
+def parse_window(spec):
+  """Parses a window spec into a (kind, first, second) tuple."""
+  match = _WINDOW.match(spec)
+  if not match:
+    raise ValueError('Invalid profiler window: ' + spec)
+  if match.group(1) is not None:
+    return ('steps', int(match.group(1)), int(match.group(2)))
+  return (match.group(3), int(match.group(4)), None)
+
+def window_type(spec):
+  """argparse type checking a window spec."""
+  try:
+    parse_window(spec)
+  except ValueError as e:
+    raise argparse.ArgumentTypeError(str(e))
+  return spec
+
+class ProfilerCallback(tf.keras.callbacks.Callback):
+  """Profiles the training steps of one or several windows."""
+
+  def __init__(self, log_dir, windows=DEFAULT_WINDOWS):
+    super(ProfilerCallback, self).__init__()
+    self.log_dir = log_dir
+    self.windows = [parse_window(spec) for spec in windows]
+    # [first, last] global steps, last None to stop at the end of the epoch
+    self._ranges = []
+    self._pending = []
+    self._global_step = 0
+    self._epoch_start_step = 0
+    self._current = None
+
+  def on_train_begin(self, logs=None):
+    steps = self.params.get('steps')
+    epochs = self.params.get('epochs') or 1
+    self._ranges = []
+    self._pending = []
+    self._global_step = 0
+    for kind, first, second in self.windows:
+      if kind == 'steps':
+        self._ranges.append([first, second])
+      elif kind == 'warmup':
+        self._ranges.append([0, first - 1])
+      elif steps is None:
+        # Unknown number of steps per epoch, resolved when the epoch begins
+        self._pending.append((kind, first))
+      else:
+        self._ranges.append(self._epoch_range(kind, first, steps, epochs, 0))
+    self._merge_ranges()
+
+  def _epoch_range(self, kind, value, steps, epochs, epoch_start_step):
+    """Resolves an epoch or steady window, from the epoch start step if `steps` is unknown."""
+    if kind == 'epoch':
+      if steps is None:
+        return [epoch_start_step, None]
+      return [(value - 1) * steps, value * steps - 1]
+    # Steady state: in the middle of the second epoch
+    if steps is None:
+      return [epoch_start_step, epoch_start_step + value - 1]
+    epoch = 1 if epochs > 1 else 0
+    nb_steps = min(value, steps)
+    first = epoch * steps + (steps - nb_steps) // 2
+    return [first, first + nb_steps - 1]
+
+  def _merge_ranges(self):
+    """Sorts the ranges and merges the overlapping ones, the profiler cannot nest."""
+    ranges = sorted(self._ranges, key=lambda r: r[0])
+    merged = []
+    for r in ranges:
+      if merged and merged[-1][1] is not None and r[0] <= merged[-1][1] + 1:
+        merged[-1][1] = None if r[1] is None else max(merged[-1][1], r[1])
+      else:
+        merged.append(list(r))
+    self._ranges = merged
+
+  def on_epoch_begin(self, epoch, logs=None):
+    self._epoch_start_step = self._global_step
+    epochs = self.params.get('epochs') or 1
+    steady_epoch = 1 if epochs > 1 else 0
+    for kind, value in list(self._pending):
+      if (kind == 'epoch' and epoch == value - 1) or (kind == 'steady' and epoch == steady_epoch):
+        self._ranges.append(self._epoch_range(kind, value, None, epochs, self._global_step))
+        self._pending.remove((kind, value))
+    self._merge_ranges()
+
+  def on_train_batch_begin(self, batch, logs=None):
+    # Windows entirely in the past, e.g. beyond the steps of a short run
+    while self._ranges and self._ranges[0][1] is not None and self._ranges[0][1] < self._global_step:
+      self._ranges.pop(0)
+    if self._current is None and self._ranges and self._ranges[0][0] <= self._global_step:
+      self._current = self._ranges.pop(0)
+      tf.profiler.experimental.start(self.log_dir)
+
+  def on_train_batch_end(self, batch, logs=None):
+    if self._current is not None and self._current[1] == self._global_step:
+      self._stop()
+    self._global_step += 1
+
+  def on_epoch_end(self, epoch, logs=None):
+    if self._current is not None and self._current[1] is None:
+      self._stop()
+
+  def on_train_end(self, logs=None):
+    if self._current is not None:
+      self._stop()
+
+  def _stop(self):
+    tf.profiler.experimental.stop()
+    self._current = None
+
+def add_profiler_arguments(parser):
+  """Adds the profiler window option to `parser`."""
+  parser.add_argument('--profile', type=window_type, nargs='*', default=DEFAULT_WINDOWS,
+                    help='Profiler windows: A-B (global steps), warmup:N, steady:N or epoch:E; '
+                         'none given to disable profiling')
+  return parser
@@ -0,0 +1,128 @@
+# Structured store of the run results.
+#
+# Every run appends one JSON record per line to the results file: its
+# configuration, the git revision, the host, the per-epoch times, the
+# throughput and the peak memory. The file is append-only, so that the runs
+# of a parallel sweep can share it and an interrupted sweep can be resumed
+# by skipping the configurations already recorded.
+import os
+import json
+import fcntl
+import socket
+import resource
+import subprocess
+from datetime import datetime
+
+# Options which do not change the measured configuration
+_IGNORED_OPTIONS = ['results_file']
+
+# Configuration of a run written in its log directory, next to its profiles
+CONFIG_FILE = 'config.json'
+
+def git_revision():
+  """Returns the git revision of the repository, None outside a checkout."""
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                   cwd=os.path.dirname(os.path.realpath(__file__)),
+                                   stderr=subprocess.DEVNULL,
+                                   universal_newlines=True).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def peak_memory():
+  """Returns the peak host RSS and the peak TF GPU memory, in MB.
+
+  The GPU peak is None without GPU, or before TF 2.5 which cannot report it.
+  """
+  # Imported here, the sweep runner reads the results without TensorFlow
+  import tensorflow as tf
+
+  # ru_maxrss is in KB on Linux
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+  peak_device = None
+  if tf.config.list_physical_devices('GPU') and hasattr(tf.config.experimental, 'get_memory_info'):
+    peak_device = tf.config.experimental.get_memory_info('GPU:0')['peak'] / 2.**20
+  return peak_rss, peak_device
+
+def run_config(flags):
+  """Returns the measured configuration of a run with the parsed `flags`."""
+  return {name: value for name, value in vars(flags).items() if name not in _IGNORED_OPTIONS}
+
+def write_config(log_dir, script, flags):
+  """Writes the configuration of a run of `script` in its log directory `log_dir`."""
+  os.makedirs(log_dir, exist_ok=True)
+  with open(os.path.join(log_dir, CONFIG_FILE), 'w') as f:
+    json.dump({'script': script, 'config': run_config(flags)}, f, sort_keys=True, indent=2)
+
+def load_config(log_dir):
+  """Returns the configuration written in the log directory `log_dir`, None without it."""
+  path = os.path.join(log_dir, CONFIG_FILE)
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+def create_record(script, flags, epoch_times, nb_samples, **metrics):
+  """Builds the record of a run of `script` with the parsed `flags`.
+
+  `epoch_times` are the training times of the epochs, `nb_samples` the
+  number of training samples per epoch. Other `metrics` are added as is.
+  """
+  peak_rss, peak_device = peak_memory()
+  record = {
+    'script': script,
+    'config': run_config(flags),
+    'git_revision': git_revision(),
+    'host': socket.gethostname(),
+    'date': datetime.now().isoformat(),
+    'epoch_times': epoch_times,
+    'throughput': [nb_samples / epoch_time for epoch_time in epoch_times],
+    'peak_rss_mb': peak_rss,
+    'peak_device_mb': peak_device,
+  }
+  record.update(metrics)
+  return record
+
+def append_record(path, record):
+  """Appends `record` to the results file `path` as one JSON line."""
+  line = json.dumps(record, sort_keys=True) + '\n'
+  with open(path, 'a') as f:
+    # Concurrent runs of a sweep append to the same file
+    fcntl.flock(f, fcntl.LOCK_EX)
+    f.write(line)
+    f.flush()
+    fcntl.flock(f, fcntl.LOCK_UN)
+
+def load_records(path):
+  """Returns the records of the results file `path`, skipping truncated lines."""
+  records = []
+  if not os.path.exists(path):
+    return records
+  with open(path) as f:
+    for line in f:
+      try:
+        records.append(json.loads(line))
+      except ValueError:
+        # Last line of a run killed while writing
+        continue
+  return records
+
+def index_records(records):
+  """Indexes the records by script, as sets of (option, value) items."""
+  index = {}
+  for record in records:
+    items = frozenset((name, str(value)) for name, value in record['config'].items())
+    index.setdefault(record['script'], []).append(items)
+  return index
+
+def is_done(index, script, config):
+  """Tells if a record of `script` matches every option of `config`."""
+  items = set((name, str(value)) for name, value in config.items())
+  return any(items <= done for done in index.get(script, []))
+
+def add_results_arguments(parser):
+  """Adds the results file option to `parser`."""
+  # The sweeps and the run scripts give the file, a run by hand records nothing by default
+  parser.add_argument('--results_file', type=str, default='',
+                    help='JSON lines file the run record is appended to, empty for none')
+  return parser
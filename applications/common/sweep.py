@@ -0,0 +1,311 @@
+# Parallel sweep runner, replacing the serial loops of the run*.sh scripts.
+#
+# Every configuration of the grid runs the application in its own process.
+# Up to --jobs configurations run at the same time, each one pinned to its
+# own set of CPU cores so that CPU-only runs do not fight over the cores.
+# A row is printed as soon as a configuration is done, in the format of the
+# data.dat files: batch_size, gpu_mode, mixed_precision, policy_type, time.
+# With --results_file the applications also append their structured record
+# to this file, and --resume skips the configurations already recorded.
+# With --batch_limits the configurations over the largest batch size found
+# by batch_probe.py are skipped instead of running out of memory.
+# With --in_process the configurations run one after the other in this
+# process, through the main() of the application: Python and TensorFlow
+# start once, and the application keeps its dataset and built models from
+# one configuration to the next. The working time then excludes the start.
+# The thread and GPU options of threads.PROCESS_OPTIONS only take effect
+# once per process: the configurations with other values than the first
+# configuration still run in their own process.
+#
+# Example, from applications/cnn:
+#   python3 ../common/sweep.py app_cnn.py --batch_size 8 16 32 --jobs 4
+import os
+import sys
+import re
+import ast
+import time
+import queue
+import contextlib
+import importlib.util
+import argparse
+import itertools
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import results
+import threads
+import batch_probe
+
+# (gpu_mode, mixed_precision, policy_type) combinations of the bash sweeps
+# plus mixed_bfloat16, the mixed policy of the CPUs
+PRECISION_CONFIGS = [(0, 0, 16), (1, 0, 16), (0, 1, 16), (0, 1, 32), (1, 1, 16), (1, 1, 32),
+                     (0, 1, 'bf16'), (1, 1, 'bf16')]
+
+WORKING_TIME = re.compile(r'Working time: ([0-9.]+) seconds')
+
+def create_grid(batch_sizes, extra_grid):
+  """Returns the configurations of the sweep as a list of argument dicts.
+
+  `extra_grid` maps option names to lists of values, crossed with the
+  batch sizes and the precision configurations of the bash sweeps.
+  """
+  names = sorted(extra_grid)
+  grid = []
+  for batch_size in batch_sizes:
+    for gpu_mode, mixed_precision, policy_type in PRECISION_CONFIGS:
+      for values in itertools.product(*[extra_grid[name] for name in names]):
+        config = {'batch_size': batch_size,
+                  'gpu_mode': gpu_mode,
+                  'mixed_precision': mixed_precision,
+                  'policy_type': policy_type}
+        config.update(zip(names, values))
+        grid.append(config)
+  return grid
+
+def parse_grid(items):
+  """Parses `key=v1,v2` items into a dict of value lists."""
+  grid = {}
+  for item in items:
+    name, _, values = item.partition('=')
+    if not values:
+      raise ValueError('Expected key=v1,v2,... but got ' + item)
+    grid[name] = values.split(',')
+  return grid
+
+def split_cores(nb_jobs, cores_per_job=0):
+  """Splits the cores usable by this process into `nb_jobs` disjoint sets.
+
+  With `cores_per_job` at 0 the cores are shared out evenly.
+  """
+  cores = sorted(os.sched_getaffinity(0))
+  if cores_per_job <= 0:
+    cores_per_job = max(1, len(cores) // nb_jobs)
+  if cores_per_job * nb_jobs > len(cores):
+    print("Warning: %d jobs of %d cores on %d cores, the jobs share cores"
+          % (nb_jobs, cores_per_job, len(cores)), file=sys.stderr)
+  return [[cores[(job * cores_per_job + i) % len(cores)] for i in range(cores_per_job)]
+          for job in range(nb_jobs)]
+
+def config_arguments(config):
+  arguments = []
+  for name, value in config.items():
+    arguments += ['--' + name, str(value)]
+  return arguments
+
+def config_row(config):
+  """Returns the data.dat columns of `config`, extra options appended."""
+  columns = [config['batch_size'], config['gpu_mode'],
+             config['mixed_precision'], config['policy_type']]
+  columns += [value for name, value in config.items()
+              if name not in ['batch_size', 'gpu_mode', 'mixed_precision', 'policy_type']]
+  return '\t'.join(str(column) for column in columns)
+
+def run_config(script, config, cores, retries=0, log_dir='', results_file=''):
+  """Runs `script` on `config` pinned to `cores`, retrying on failure.
+
+  Returns the working time printed by the application, None if every
+  attempt failed.
+  """
+  command = [sys.executable, script] + config_arguments(config)
+  if results_file:
+    command += ['--results_file', results_file]
+  for attempt in range(retries + 1):
+    # Pinned from this thread of the sweep: a preexec_fn is not safe in the
+    # threads of a process. The application has not started its threads yet
+    # when it is pinned, they inherit the cores.
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True)
+    try:
+      os.sched_setaffinity(process.pid, cores)
+    except ProcessLookupError:
+      # Already exited, its output tells why
+      pass
+    stdout, _ = process.communicate()
+    if log_dir:
+      log_name = config_row(config).replace('\t', '_') + '_' + str(attempt) + '.log'
+      with open(os.path.join(log_dir, log_name), 'w') as f:
+        f.write(stdout)
+
+    match = WORKING_TIME.search(stdout)
+    if process.returncode == 0 and match:
+      return float(match.group(1))
+    print("Failed (attempt %d/%d, exit code %d): %s"
+          % (attempt + 1, retries + 1, process.returncode, ' '.join(command)), file=sys.stderr)
+  return None
+
+def has_main(script):
+  """Tells if `script` defines a main(argv) function, without running it."""
+  with open(script) as f:
+    tree = ast.parse(f.read(), script)
+  return any(isinstance(node, ast.FunctionDef) and node.name == 'main' for node in tree.body)
+
+def process_options(config):
+  """Returns the options of `config` which take effect once per process."""
+  return [(name, str(config[name])) for name in threads.PROCESS_OPTIONS if name in config]
+
+def load_script(script):
+  """Imports the application `script` as a module, without running its main()."""
+  name = os.path.splitext(os.path.basename(script))[0]
+  spec = importlib.util.spec_from_file_location(name, script)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+def run_config_in_process(module, script, config, retries=0, log_dir='', results_file=''):
+  """Runs `config` through the main() of the imported application `module`.
+
+  Returns the time taken by main(), None if every attempt failed.
+  """
+  argv = [script] + config_arguments(config)
+  if results_file:
+    argv += ['--results_file', results_file]
+  for attempt in range(retries + 1):
+    start_time = time.time()
+    try:
+      if log_dir:
+        log_name = config_row(config).replace('\t', '_') + '_' + str(attempt) + '.log'
+        with open(os.path.join(log_dir, log_name), 'w') as f, contextlib.redirect_stdout(f):
+          module.main(argv)
+      else:
+        module.main(argv)
+      return time.time() - start_time
+    # argparse errors exit
+    except (Exception, SystemExit) as e:
+      print("Failed (attempt %d/%d, %s: %s): %s"
+            % (attempt + 1, retries + 1, type(e).__name__, e, ' '.join(argv)), file=sys.stderr)
+  return None
+
+def _write_row(config, working_time, output):
+  row = config_row(config) + '\t' + str(working_time)
+  print(row, flush=True)
+  if output:
+    with open(output, 'a') as f:
+      f.write(row + '\n')
+
+def run_sweep(script, grid, nb_jobs=1, cores_per_job=0, retries=0, output='', log_dir='',
+              results_file=''):
+  """Runs every configuration of `grid`, at most `nb_jobs` at the same time.
+
+  The rows are printed, and appended to `output`, as the runs finish.
+  """
+  free_cores = queue.Queue()
+  for cores in split_cores(nb_jobs, cores_per_job):
+    free_cores.put(cores)
+  lock = threading.Lock()
+
+  def worker(config):
+    cores = free_cores.get()
+    try:
+      working_time = run_config(script, config, cores, retries, log_dir, results_file)
+    finally:
+      free_cores.put(cores)
+    if working_time is None:
+      return
+    with lock:
+      _write_row(config, working_time, output)
+
+  # The threads only wait for their subprocess
+  with ThreadPoolExecutor(max_workers=nb_jobs) as executor:
+    list(executor.map(worker, grid))
+
+def run_sweep_in_process(script, grid, retries=0, output='', log_dir='', results_file=''):
+  """Runs every configuration of `grid` in this process, one after the other.
+
+  The configurations whose process options differ from the first one run
+  in their own process instead, after the others.
+  """
+  if not grid:
+    return
+  options = process_options(grid[0])
+  in_process = [config for config in grid if process_options(config) == options]
+  subprocesses = [config for config in grid if process_options(config) != options]
+  if subprocesses:
+    print("%d configurations with other thread or GPU options run in their own process"
+          % len(subprocesses), file=sys.stderr)
+
+  # The environment of the first configuration, set before the application imports TensorFlow
+  threads.configure_environment([script] + config_arguments(grid[0]))
+  module = load_script(script)
+  for config in in_process:
+    working_time = run_config_in_process(module, script, config, retries, log_dir, results_file)
+    if working_time is not None:
+      _write_row(config, working_time, output)
+
+  cores = sorted(os.sched_getaffinity(0))
+  for config in subprocesses:
+    working_time = run_config(script, config, cores, retries, log_dir, results_file)
+    if working_time is not None:
+      _write_row(config, working_time, output)
+
+def create_arg_parser():
+  parser = argparse.ArgumentParser(description='Running a sweep of an application in parallel.')
+  parser.add_argument('script', type=str,
+                    help='Application to run, e.g. app_cnn.py')
+  parser.add_argument('--batch_size', type=int, nargs='+', required=True,
+                    help='Batch sizes of the sweep')
+  parser.add_argument('--grid', type=str, nargs='*', default=[],
+                    help='Other options of the application to sweep, as key=v1,v2,...')
+  parser.add_argument('--jobs', type=int, default=1,
+                    help='Number of configurations running at the same time')
+  parser.add_argument('--cores_per_job', type=int, default=0,
+                    help='Number of CPU cores pinned to each job, 0 to share them out evenly')
+  parser.add_argument('--retries', type=int, default=0,
+                    help='Number of retries of a failed configuration')
+  parser.add_argument('--output', type=str, default='',
+                    help='File the rows are appended to as the runs finish')
+  parser.add_argument('--log_dir', type=str, default='',
+                    help='Directory keeping the output of every run')
+  parser.add_argument('--results_file', type=str, default='',
+                    help='JSON lines file the applications append their record to')
+  parser.add_argument('--batch_limits', type=str, default='',
+                    help='JSON file of batch_probe.py, skipping the batch sizes over the limits')
+  parser.add_argument('--resume', action='store_true',
+                    help='Skipping the configurations already in --results_file')
+  parser.add_argument('--in_process', action='store_true',
+                    help='Running the configurations one after the other in this process, '
+                         'through the main(argv) of the application')
+  return parser
+
+def main(argv):
+  parser = create_arg_parser()
+  flags = parser.parse_args(args=argv[1:])
+
+  try:
+    extra_grid = parse_grid(flags.grid)
+  except ValueError as e:
+    parser.error(str(e))
+
+  grid = create_grid(flags.batch_size, extra_grid)
+  if flags.batch_limits:
+    limits = batch_probe.load_limits(flags.batch_limits)
+    nb_configs = len(grid)
+    grid = [config for config in grid if batch_probe.within_limits(limits, flags.script, config)]
+    print("Batch limits: %d of %d configurations over the largest batch size"
+          % (nb_configs - len(grid), nb_configs), file=sys.stderr)
+  if flags.resume:
+    if not flags.results_file:
+      parser.error('--resume needs --results_file')
+    index = results.index_records(results.load_records(flags.results_file))
+    script = os.path.basename(flags.script)
+    nb_configs = len(grid)
+    grid = [config for config in grid if not results.is_done(index, script, config)]
+    print("Resuming: %d of %d configurations already done"
+          % (nb_configs - len(grid), nb_configs), file=sys.stderr)
+
+  if flags.log_dir:
+    os.makedirs(flags.log_dir, exist_ok=True)
+  if flags.in_process:
+    if flags.jobs != 1:
+      parser.error('--in_process runs one configuration at a time, --jobs must be 1')
+    if not has_main(flags.script):
+      parser.error('--in_process runs the main(argv) of the application, which %s does not define'
+                   % flags.script)
+    run_sweep_in_process(flags.script, grid, flags.retries, flags.output, flags.log_dir,
+                         flags.results_file)
+    return
+  run_sweep(flags.script, grid, flags.jobs, flags.cores_per_job,
+            flags.retries, flags.output, flags.log_dir, flags.results_file)
+
+if __name__ == '__main__':
+  main(argv=sys.argv)
@@ -0,0 +1,152 @@
+# Thread pools of TensorFlow, OpenMP and oneDNN.
+#
+# The environment variables read by TensorFlow and its libraries (OpenMP,
+# oneDNN, the GPU thread mode) only take effect when set before TensorFlow
+# is imported: `configure_environment()` reads the thread options straight
+# from the command line and is called by the applications before their
+# TensorFlow imports. This module does not import TensorFlow itself.
+# `configure_tensorflow()` then sizes the intra-op and inter-op pools,
+# before TensorFlow creates them.
+#
+# Run as a script, it tunes the threads of an application: short trials of
+# the application over candidate configurations, keeping the fastest.
+# Example, from applications/cnn:
+#   python3 ../common/threads.py app_cnn.py --batch_size 256 --intra 2 4 8 --inter 1 2
+import os
+import re
+import sys
+import json
+import argparse
+import itertools
+import subprocess
+
+THROUGHPUT = re.compile(r'^Throughput: (.*)$', re.M)
+
+# Options taking effect once per process: the environment set by
+# configure_environment() and the pools sized by configure_tensorflow()
+PROCESS_OPTIONS = ['intra_op_threads', 'inter_op_threads', 'omp_threads', 'kmp_blocktime',
+                   'onednn', 'gpu_mode']
+
+def add_thread_arguments(parser):
+  """Adds the thread options to `parser`, 0 (or -1) keeping the defaults."""
+  parser.add_argument('--intra_op_threads', type=int, default=0,
+                    help='Threads of the intra-op pool, running the kernels, 0 for one per core')
+  parser.add_argument('--inter_op_threads', type=int, default=0,
+                    help='Threads of the inter-op pool, running independent ops, 0 for the default')
+  parser.add_argument('--tf_data_threads', type=int, default=0,
+                    help='Size of a private thread pool of the tf.data pipelines, 0 to share the '
+                         'inter-op pool')
+  parser.add_argument('--omp_threads', type=int, default=0,
+                    help='OMP_NUM_THREADS of the oneDNN kernels, 0 to follow --intra_op_threads')
+  parser.add_argument('--kmp_blocktime', type=int, default=-1,
+                    help='KMP_BLOCKTIME in ms, the spinning of the OpenMP threads, -1 to keep it')
+  parser.add_argument('--onednn', type=int, choices=[-1, 0, 1], default=-1,
+                    help='TF_ENABLE_ONEDNN_OPTS: 1 to enable the oneDNN kernels, 0 to disable them, '
+                         '-1 to keep the default')
+  return parser
+
+def configure_environment(argv):
+  """Sets the environment of the thread options of `argv`, before TensorFlow is imported."""
+  parser = argparse.ArgumentParser(add_help=False)
+  add_thread_arguments(parser)
+  parser.add_argument('--gpu_mode', type=int, default=0)
+  flags, _ = parser.parse_known_args(argv[1:])
+
+  omp_threads = flags.omp_threads or flags.intra_op_threads
+  if omp_threads > 0:
+    os.environ['OMP_NUM_THREADS'] = str(omp_threads)
+  if flags.kmp_blocktime >= 0:
+    os.environ['KMP_BLOCKTIME'] = str(flags.kmp_blocktime)
+  if flags.onednn >= 0:
+    os.environ['TF_ENABLE_ONEDNN_OPTS'] = str(flags.onednn)
+  if flags.gpu_mode == 1:
+    # Read when the GPU device is created
+    os.environ['TF_GPU_THREAD_MODE'] = 'gpu_private'
+  return flags
+
+def configure_tensorflow(flags):
+  """Sizes the intra-op and inter-op pools of TensorFlow.
+
+  Once the pools exist, in the later runs of a sweep in one process, they
+  keep their size and a warning is printed.
+  """
+  import tensorflow as tf
+
+  try:
+    if flags.intra_op_threads > 0:
+      tf.config.threading.set_intra_op_parallelism_threads(flags.intra_op_threads)
+    if flags.inter_op_threads > 0:
+      tf.config.threading.set_inter_op_parallelism_threads(flags.inter_op_threads)
+  except RuntimeError as e:
+    print("Warning: the thread pools are already created, " + str(e), file=sys.stderr)
+
+def candidate_configs(intra, inter, tf_data):
+  """Returns the thread configurations crossing the candidate values."""
+  return [{'intra_op_threads': a, 'inter_op_threads': b, 'tf_data_threads': c}
+          for a, b, c in itertools.product(intra, inter, tf_data)]
+
+def run_trial(command, config):
+  """Runs one trial of `command` with the thread options of `config`.
+
+  Returns the steady-state samples/sec printed by ThroughputCallback, None
+  if the trial failed.
+  """
+  arguments = []
+  for name, value in config.items():
+    arguments += ['--' + name, str(value)]
+  process = subprocess.run([sys.executable] + command + arguments, stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT, universal_newlines=True)
+  matches = THROUGHPUT.findall(process.stdout)
+  if process.returncode != 0 or not matches:
+    print("Failed trial (exit code %d): %s" % (process.returncode, json.dumps(config)),
+          file=sys.stderr)
+    return None
+  return json.loads(matches[-1])['steady_state']['samples_per_sec']
+
+def tune(command, configs):
+  """Runs a trial of every configuration and returns the fastest one with its samples/sec."""
+  best_config, best_throughput = None, None
+  for config in configs:
+    throughput = run_trial(command, config)
+    print(json.dumps(config) + '\t' + str(throughput), flush=True)
+    if throughput is not None and (best_throughput is None or throughput > best_throughput):
+      best_config, best_throughput = config, throughput
+  return best_config, best_throughput
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Tuning the thread pools of an application.')
+  parser.add_argument('--intra', type=int, nargs='+', default=[0],
+                    help='Candidate sizes of the intra-op pool')
+  parser.add_argument('--inter', type=int, nargs='+', default=[0],
+                    help='Candidate sizes of the inter-op pool')
+  parser.add_argument('--tf_data', type=int, nargs='+', default=[0],
+                    help='Candidate sizes of the tf.data private pool')
+  parser.add_argument('--trial_samples', type=int, default=5000,
+                    help='Number of training samples of a trial')
+  parser.add_argument('--trial_epochs', type=int, default=2,
+                    help='Number of epochs of a trial, the first one being left out')
+  parser.add_argument('--output', type=str, default='',
+                    help='JSON file the fastest configuration is written to')
+  parser.add_argument('command', nargs=argparse.REMAINDER,
+                    help='Application and its options')
+  flags = parser.parse_args(args=argv[1:])
+  if not flags.command:
+    parser.error('No application to tune')
+
+  # Short trials, without profiling nor results
+  command = flags.command + ['--nb_samples', str(flags.trial_samples),
+                             '--epochs', str(flags.trial_epochs),
+                             '--profile', '--results_file', '']
+  configs = candidate_configs(flags.intra, flags.inter, flags.tf_data)
+  best_config, best_throughput = tune(command, configs)
+  if best_config is None:
+    sys.exit('Every trial failed')
+
+  print("Fastest: " + ' '.join('--%s %d' % item for item in best_config.items())
+        + " (%.1f samples/sec)" % best_throughput)
+  if flags.output:
+    with open(flags.output, 'w') as f:
+      json.dump(dict(best_config, samples_per_sec=best_throughput), f, indent=2)
+
+if __name__ == '__main__':
+  main(argv=sys.argv)
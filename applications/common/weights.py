@@ -0,0 +1,80 @@
+# Offline resolution of the pretrained ResNet50 weights.
+#
+# ResNet50(weights='imagenet') downloads the weights on first use, which
+# fails on the nodes without network and stalls the start of the others.
+# Here the weights are looked up in a local directory first (the Keras
+# download cache by default), or taken from a given .h5 file. The download
+# only happens when allowed, and a run can fall back to random weights,
+# which is then printed and recorded.
+# Run `python weights.py` on a connected machine to fill the directory.
+import os
+import sys
+import argparse
+
+# File of the ImageNet weights of ResNet50 without its top, as named by Keras
+RESNET50_NOTOP = 'resnet50_weights_tf_dim_ordering_tf_kernels_notop.h5'
+RESNET50_NOTOP_URL = ('https://storage.googleapis.com/tensorflow/keras-applications/resnet/'
+                      + RESNET50_NOTOP)
+
+WEIGHTS_DIR = os.environ.get('KERAS_WEIGHTS_DIR',
+                             os.path.join(os.path.expanduser('~'), '.keras', 'models'))
+
+def resolve_weights(weights='imagenet', weights_dir=WEIGHTS_DIR, allow_download=True,
+                    allow_random=False):
+  """Returns the `weights` argument of ResNet50 without going to the network when possible.
+
+  `weights` is 'imagenet', 'random' or the path of an .h5 file. The
+  ImageNet weights are taken from `weights_dir`, else downloaded if
+  `allow_download`, else replaced by random weights if `allow_random`.
+  Raises FileNotFoundError otherwise.
+  """
+  if weights == 'random':
+    return None
+  if weights != 'imagenet':
+    if not os.path.exists(weights):
+      raise FileNotFoundError('No weights file at ' + weights)
+    return weights
+
+  path = os.path.join(weights_dir, RESNET50_NOTOP)
+  if os.path.exists(path):
+    return path
+  if allow_download:
+    return 'imagenet'
+  if allow_random:
+    print("Warning: no ImageNet weights at %s, the backbone starts from random weights" % path,
+          file=sys.stderr)
+    return None
+  raise FileNotFoundError('No ImageNet weights at %s: copy %s there, or allow the download '
+                          'or the random weights' % (path, RESNET50_NOTOP))
+
+def weights_name(resolved):
+  """Name of resolved weights for the records: 'random', 'imagenet' or the file."""
+  if resolved is None:
+    return 'random'
+  return resolved
+
+def add_weights_arguments(parser):
+  """Adds the weight resolution options to `parser`."""
+  parser.add_argument('--weights', type=str, default='imagenet',
+                    help="Backbone weights: 'imagenet', 'random' or the path of an .h5 file")
+  parser.add_argument('--weights_dir', type=str, default=WEIGHTS_DIR,
+                    help='Directory searched for the ImageNet weights before any download')
+  parser.add_argument('--allow_download', type=int, choices=[0,1], default=1,
+                    help='Downloading the ImageNet weights when they are not in --weights_dir')
+  parser.add_argument('--allow_random_weights', type=int, choices=[0,1], default=0,
+                    help='Starting from random weights when the ImageNet weights are not found')
+  return parser
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Downloading the ResNet50 weights into the local directory.')
+  parser.add_argument('--weights_dir', type=str, default=WEIGHTS_DIR,
+                    help='Directory the weights are stored in')
+  flags = parser.parse_args(args=argv[1:])
+
+  from tensorflow.keras.utils import get_file
+  path = get_file(RESNET50_NOTOP, RESNET50_NOTOP_URL, cache_dir=flags.weights_dir,
+                  cache_subdir='')
+  print(path)
+
+if __name__ == '__main__':
+  main(argv=sys.argv)
@@ -0,0 +1,43 @@
+# XLA compilation of the training step.
+#
+# With --jit 1 the training step is compiled with XLA, which fuses the
+# element-wise ops into the convolutions and matmuls around them, on CPU as
+# well as on GPU. Keras takes jit_compile in model.compile() from TF 2.6;
+# with older versions the graph is auto-clustered instead, the clusters
+# being compiled with XLA, on CPU too through TF_XLA_FLAGS.
+#
+# The compilation happens during the first step, ThroughputCallback splits
+# the first epoch into this compilation time and the execution time.
+import os
+import inspect
+
+import tensorflow as tf
+
+_CPU_JIT_FLAG = '--tf_xla_cpu_global_jit'
+
+def has_jit_compile():
+  """True when model.compile() takes the jit_compile argument."""
+  return 'jit_compile' in inspect.signature(tf.keras.Model.compile).parameters
+
+def compile_arguments(jit=0):
+  """Sets up XLA for the --jit option and returns the extra arguments of model.compile().
+
+  Called for every run, so that a run without XLA does not inherit the
+  auto-clustering of a previous run of the process.
+  """
+  if has_jit_compile():
+    tf.config.optimizer.set_jit(False)
+    return {'jit_compile': jit == 1}
+
+  if jit == 1:
+    xla_flags = os.environ.get('TF_XLA_FLAGS', '')
+    if _CPU_JIT_FLAG not in xla_flags:
+      os.environ['TF_XLA_FLAGS'] = (xla_flags + ' ' + _CPU_JIT_FLAG).strip()
+  tf.config.optimizer.set_jit(jit == 1)
+  return {}
+
+def add_xla_arguments(parser):
+  """Adds the XLA option to `parser`."""
+  parser.add_argument('--jit', type=int, choices=[0,1], default=0,
+                    help='Compiling the training step with XLA')
+  return parser
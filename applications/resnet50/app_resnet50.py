@@ -1,15 +1,22 @@
 import os
 import sys
+import functools
 
 # To block info messages of TensorFlow
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
-from tensorflow.keras.mixed_precision import experimental as mixed_precision
+# Shared helpers live in applications/common
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from common import threads
+# The thread environment must be set before TensorFlow is imported
+threads.configure_environment(sys.argv)
+
 from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
 import tensorflow.keras as keras
 from tensorflow.keras import models
 from tensorflow.keras import layers
 from tensorflow.keras import optimizers
+from tensorflow.keras.layers.experimental import preprocessing
 import tensorflow as tf
 from keras.utils import np_utils
 from keras.models import load_model
@@ -18,84 +25,244 @@ from keras.preprocessing import image
 import numpy as np
 import matplotlib.pyplot as plt
 from PIL import Image
-import pandas as pd
 
+import json
 import argparse
 from datetime import datetime
 import time
 
+from common import accumulation, callbacks, dataset, distribute, features, model_factory, model_stats, pipeline, precision, profiling, results, weights, xla
+
 #BATCH_SIZE=20
 
+# Input resolutions of ResNet50, the CIFAR-10 images are resized from 32x32
+IMAGE_SIZE_CHOICES = [32, 64, 128, 224, 256]
+
+# Size of the globally pooled ResNet50 features
+NB_FEATURES = 2048
+
+# Loss of the --label_mode labels: int class indices, or one-hot rows
+# with the sigmoid loss of the previous runs. Both are measured by the
+# accuracy of the argmax class.
+LOSSES = {'sparse': 'sparse_categorical_crossentropy', 'one_hot': 'binary_crossentropy'}
+LABEL_MODE_CHOICES = sorted(LOSSES)
+
+def accuracy_metric(label_mode='sparse'):
+	# Named acc as before, for the history and its plots
+	if label_mode == 'sparse':
+		return tf.keras.metrics.SparseCategoricalAccuracy(name='acc')
+	return tf.keras.metrics.CategoricalAccuracy(name='acc')
+
+# Backbones built by this process with their initial weights, a backbone
+# asked again is reset to them instead of being built and loaded again
+_CONV_BASES = {}
+
 # Download the dataset and plotting it
-def create_conv_base():
-	conv_base = ResNet50(weights='imagenet', include_top=False, input_shape=(256, 256, 3))
+def create_conv_base(image_size=256, pooling=None, conv_weights='imagenet'):
+	# conv_weights as returned by weights.resolve_weights()
+	strategy = tf.distribute.get_strategy()
+	# The variables belong to the strategy in scope, and the layers take the
+	# precision policy of the time they are built
+	key = (image_size, pooling, conv_weights, tf.keras.mixed_precision.global_policy().name,
+	       type(strategy).__name__, strategy.num_replicas_in_sync)
+	if key in _CONV_BASES:
+		conv_base, initial_weights = _CONV_BASES[key]
+		conv_base.set_weights(initial_weights)
+		conv_base.trainable = True
+		return conv_base
+
+	conv_base = ResNet50(weights=conv_weights, include_top=False, input_shape=(image_size, image_size, 3),
+	                     pooling=pooling)
+	_CONV_BASES[key] = (conv_base, conv_base.get_weights())
 
 	# prints the Resnet architecture
 	conv_base.summary()
 	return conv_base
 
-def download_dataset():
+# Kept for the next configurations of a sweep running in this process
+@functools.lru_cache(maxsize=2)
+def download_dataset(nb_samples=dataset.NB_SAMPLES, seed=None, cache_dir=dataset.CACHE_DIR,
+                     normalize=True, label_mode='sparse'):
 	#There are 50000 samples in the training dataset. You can select a subset of the traing set hre:
-	NB_SAMPLES=50000
-
-	(x_train, y_train), (x_test, y_test) = cifar10.load_data()
+	# The subset is drawn while the images are still uint8
+	x_train, y_train, x_test, y_test = dataset.load_cifar10(nb_samples, seed, cache_dir)
 
-	x_train = x_train / 255.0
-	x_test = x_test / 255.0
+	# Otherwise the images stay uint8, scaled by the model or the tf.data pipeline
+	if normalize:
+		x_train = dataset.normalize(x_train)
+		x_test = dataset.normalize(x_test)
 
-	y_train = np_utils.to_categorical(y_train, 10)
-	y_test = np_utils.to_categorical(y_test, 10)
+	# Otherwise the labels stay the uint8 class indices of the cache, (N, 1) arrays
+	if label_mode == 'one_hot':
+		y_train = np_utils.to_categorical(y_train, 10)
+		y_test = np_utils.to_categorical(y_test, 10)
 
 	print(x_train.shape)
 	print(x_test.shape)
 
-	print("There are "+str(x_train.shape[0])+" training samples")
-	print("There are "+str(x_test.shape[0])+" testing samples")
-
-	df = pd.DataFrame(list(zip(x_train, y_train)), columns =['x_train', 'y_train']) 
-
-	val = df.sample(NB_SAMPLES) # take only 5% of the samples
-
-
-	x_train = np.array([ i for i in list(val['x_train'])])
-	y_train = np.array([ i for i in list(val['y_train'])])
-
 	print("There are "+str(x_train.shape[0])+" training samples")
 	print("There are "+str(x_test.shape[0])+" testing samples")
 	return(x_train, y_train, x_test, y_test)
 
-def create_resnet_model():
-	conv_base = create_conv_base()
+# Scale and resize the CIFAR-10 images for ResNet50
+def add_preprocessing(model, normalization='host', image_size=256, resize='model'):
+	# With resize='host' the tf.data pipeline resizes the images
+	input_size = image_size if resize == 'host' else 32
+	# Built right away, the model report reads the input of every layer
+	model.add(layers.InputLayer(input_shape=(input_size, input_size, 3)))
+	if normalization == 'graph':
+		model.add(dataset.rescaling_layer())
+	if input_size != image_size:
+		# A single resize instead of a chain of UpSampling2D,
+		# nearest as UpSampling2D to keep the same images
+		model.add(preprocessing.Resizing(image_size, image_size, interpolation='nearest'))
+
+# Classifier trained on top of ResNet50
+def add_head(model, head='flatten'):
+	# Flatten feeds Dense(128) with all of the feature map, the global poolings one value per channel
+	for layer in model_factory.build_layers(model_factory.resnet50_head_layers(head)):
+		model.add(layer)
+
+def create_resnet_model(normalization='host', image_size=256, resize='model', head='flatten',
+                        conv_weights='imagenet'):
+	conv_base = create_conv_base(image_size, conv_weights=conv_weights)
 	model = models.Sequential()
-	model.add(layers.UpSampling2D((2,2)))
-	model.add(layers.UpSampling2D((2,2)))
-	model.add(layers.UpSampling2D((2,2)))
+	add_preprocessing(model, normalization, image_size, resize)
 	model.add(conv_base)
-	model.add(layers.Flatten())
-	model.add(layers.BatchNormalization())
-	model.add(layers.Dense(128, activation='relu'))
-	model.add(layers.Dropout(0.5))
-	model.add(layers.BatchNormalization())
-	model.add(layers.Dense(64, activation='relu'))
-	model.add(layers.Dropout(0.5))
-	model.add(layers.BatchNormalization())
-	model.add(layers.Dense(10, activation='softmax'))
+	add_head(model, head)
+
+	return model
+
+# Frozen backbone: the head alone, trained on the pooled ResNet50 features
+def create_head_model():
+	model = models.Sequential()
+	model.add(layers.InputLayer(input_shape=(NB_FEATURES,)))
+	# The features are already pooled, Flatten keeps them as they are
+	add_head(model, 'flatten')
 
 	return model
 
+# Parameters and FLOPs of the whole model and of the head alone
+def model_report(model):
+	# The head is made of the layers after the ResNet50 backbone
+	backbone = [i for i, layer in enumerate(model.layers) if isinstance(layer, models.Model)]
+	head_layers = model.layers[backbone[-1] + 1:] if backbone else model.layers
+	report = {'model': model_stats.layers_stats(model.layers),
+	          'head': model_stats.layers_stats(head_layers)}
+	print("Model: " + json.dumps(report))
+	return report
+
+# Compute the pooled features of the frozen backbone once, or load them from the cache
+def extract_features(x_train, x_test, flags, conv_weights='imagenet'):
+	conv_base = create_conv_base(flags.image_size, 'avg', conv_weights)
+	conv_base.trainable = False
+	extractor = models.Sequential()
+	add_preprocessing(extractor, flags.normalization, flags.image_size)
+	extractor.add(conv_base)
+
+	key = features.cache_key(conv_base, flags.image_size,
+	                         precision.policy_name(flags.mixed_precision, flags.policy_type))
+	start_time = time.time()
+	f_train = features.load_features(extractor, x_train, key, flags.batch_size, flags.feature_cache_dir)
+	f_test = features.load_features(extractor, x_test, key, flags.batch_size, flags.feature_cache_dir)
+	extraction_time = time.time() - start_time
+	print("Feature extraction: %s seconds" % extraction_time)
+	return f_train, f_test, extraction_time
+
+# tf.data pipelines of the augmentation and of the resize on the host
+def create_datasets(x_train, y_train, x_test, y_test, flags, batch_size, resize='host'):
+	resize_fn = None
+	if resize == 'host':
+		resize_fn = pipeline.resize_img(flags.image_size, normalize=flags.normalization == 'host')
+	# Shuffled while the images are still 32x32 uint8, as model.fit does with arrays
+	ds_train = tf.data.Dataset.from_tensor_slices((x_train, y_train)).shuffle(len(x_train),
+	                                                                        seed=flags.augmentation_seed)
+	ds_test = tf.data.Dataset.from_tensor_slices((x_test, y_test))
+	train_fn = resize_fn
+	if flags.augmentation == 1:
+		# A single parallel map of the augmentation and of the resize
+		ds_train = pipeline.with_seeds(ds_train, flags.augmentation_seed)
+		train_fn = pipeline.augment_img(resize_fn)
+	ds_train = pipeline.build_pipeline(ds_train, batch_size, cache_position='none', map_fn=train_fn,
+	                                   private_threads=flags.tf_data_threads)
+	ds_test = pipeline.build_pipeline(ds_test, batch_size, cache_position='none', map_fn=resize_fn,
+	                                  private_threads=flags.tf_data_threads)
+	return ds_train, ds_test
 
 # Train the model and evaluating it
-def train_model(model, batch_size):
-	x_train, y_train, x_test, y_test = download_dataset()
-	model.compile(optimizer=optimizers.RMSprop(lr=2e-5), loss='binary_crossentropy', metrics=['acc'])
+def train_model(model, flags, conv_weights='imagenet', strategy=None):
+	strategy = strategy or tf.distribute.get_strategy()
+	# --batch_size samples for every replica
+	batch_size = distribute.global_batch_size(flags.batch_size, strategy)
+	# The frozen backbone resizes the images itself
+	resize = 'model' if flags.frozen_backbone == 1 else flags.resize
+	# The tf.data pipeline scales the uint8 images with the resize
+	normalize = flags.normalization == 'host' and resize == 'model'
+	x_train, y_train, x_test, y_test = download_dataset(flags.nb_samples, flags.seed,
+	                                                    flags.cache_dir, normalize, flags.label_mode)
+	extraction_time = None
+	if flags.frozen_backbone == 1:
+		# The head is trained on the features instead of the images
+		x_train, x_test, extraction_time = extract_features(x_train, x_test, flags, conv_weights)
+	# Set before compile(), which drops the training function already traced
+	accumulation.accumulate_gradients(model, flags.accumulation_steps)
+	micro_batch_size = -(-flags.batch_size // flags.accumulation_steps)
+	if flags.accumulation_steps > 1:
+		print('Accumulating the gradients of %d micro-batches of %d samples per replica'
+		      % (flags.accumulation_steps, micro_batch_size))
+	with strategy.scope():
+		model.compile(optimizer=precision.wrap_optimizer(optimizers.RMSprop(lr=2e-5)), loss=LOSSES[flags.label_mode],
+		              metrics=[accuracy_metric(flags.label_mode)],
+		              **xla.compile_arguments(flags.jit))
+	report = model_report(model)
 
 	# Create a TensorBoard callback
-	logs = "logs/" + datetime.now().strftime("%Y%m%d-%H%M%S")
-	tboard_callback = tf.keras.callbacks.TensorBoard(log_dir = logs, histogram_freq = 1,profile_batch = '500,520')
-	history = model.fit(x_train, y_train, epochs=10, batch_size=batch_size, validation_data=(x_test, y_test), callbacks = [tboard_callback])
+	# The pid tells apart the runs of a parallel sweep started in the same second
+	logs = "logs/" + datetime.now().strftime("%Y%m%d-%H%M%S") + "_" + str(os.getpid())
+	# The steps are profiled by the windows of --profile
+	tboard_callback = tf.keras.callbacks.TensorBoard(log_dir = logs, histogram_freq = 1,profile_batch = 0)
+	throughput_callback = callbacks.ThroughputCallback(batch_size, len(x_train), strategy.num_replicas_in_sync)
+	fit_callbacks = [throughput_callback]
+	# The other workers of a multi-worker run write no logs
+	chief = distribute.is_chief(strategy)
+	if chief:
+		fit_callbacks.append(tboard_callback)
+		# Read by analyze_profiles.py --group
+		results.write_config(logs, os.path.basename(__file__), flags)
+	if flags.profile and chief:
+		fit_callbacks.append(profiling.ProfilerCallback(logs + "/train", flags.profile))
+	# The arrays go to model.fit directly unless augmented or resized on the host
+	use_pipeline = resize == 'host' or flags.augmentation == 1
+	if not use_pipeline:
+		history = model.fit(x_train, y_train, epochs=flags.epochs, batch_size=batch_size, validation_data=(x_test, y_test), callbacks = fit_callbacks)
+	else:
+		ds_train, ds_test = create_datasets(x_train, y_train, x_test, y_test, flags, batch_size, resize)
+		history = model.fit(ds_train, epochs=flags.epochs, validation_data=ds_test, callbacks = fit_callbacks)
 
 	print("Validation:")
-	model.evaluate(x_test, y_test)
+	if not use_pipeline:
+		test_loss, test_acc = model.evaluate(x_test, y_test)
+	else:
+		test_loss, test_acc = model.evaluate(ds_test)
+
+	# Share of the step time waiting on the tf.data pipeline, measured after the evaluation
+	input_wait = None
+	if use_pipeline and flags.input_wait_steps > 0:
+		input_wait = callbacks.measure_input_wait(
+		    model, ds_train, throughput_callback.summary()['steady_state']['step_p50_ms'],
+		    flags.input_wait_steps)
+		print("Input wait: " + json.dumps(input_wait))
+
+	if flags.results_file and chief:
+		record = results.create_record(os.path.basename(__file__), flags, throughput_callback.epoch_times,
+		                               len(x_train), test_accuracy=test_acc,
+		                               throughput_summary=throughput_callback.summary(),
+		                               feature_extraction_time=extraction_time,
+		                               input_wait=input_wait,
+		                               micro_batch_size=micro_batch_size,
+		                               model_stats=report,
+		                               conv_weights=weights.weights_name(conv_weights))
+		results.append_record(flags.results_file, record)
 
 
 	history_dict = history.history
@@ -129,9 +296,12 @@ def train_model(model, batch_size):
 	plt.ylabel('Accuracy')
 	plt.legend()
 	plt.savefig("resnet50_accuracy.png")
+	# The next run of a sweep in this process starts from new figures
+	plt.close('all')
 
 def create_arg_parser():
-  batch_size_choices = [16,32,64,128,256]
+  # Beyond 256 with --accumulation_steps, the micro-batches staying within 256
+  batch_size_choices = [16,32,64,128,256,512,1024,2048]
   parser = argparse.ArgumentParser(description='Configuring the CNN model.')
   parser.add_argument('--batch_size', type=int, choices=batch_size_choices, 
                     default=32, required=True,
@@ -142,9 +312,50 @@ def create_arg_parser():
   parser.add_argument('--mixed_precision', type=int, choices=[0,1], 
                     default=0, required=True,
                     help='Define the mixed precision strategy or not')
-  parser.add_argument('--policy_type', type=int, choices=[16, 32],
-                    default=16, required=False,
-                    help="Setting the policy on: 16 for mixed_float16 or 32 for float32")
+  parser.add_argument('--policy_type', type=str, choices=precision.POLICY_TYPE_CHOICES,
+                    default='16', required=False,
+                    help="Setting the policy on: 16 for mixed_float16, bf16 for mixed_bfloat16 or 32 for float32")
+  parser.add_argument('--image_size', type=int, choices=IMAGE_SIZE_CHOICES,
+                    default=256, required=False,
+                    help='Input resolution of ResNet50, the 32x32 images are resized to it')
+  parser.add_argument('--resize', type=str, choices=['model', 'host'],
+                    default='model', required=False,
+                    help='Resizing with a layer of the model, or on the host in a tf.data pipeline')
+  parser.add_argument('--label_mode', type=str, choices=LABEL_MODE_CHOICES,
+                    default='sparse', required=False,
+                    help='Labels as int class indices with the sparse categorical loss, or as one-hot '
+                         'rows with the binary cross-entropy')
+  parser.add_argument('--head', type=str, choices=model_factory.HEAD_CHOICES,
+                    default='flatten', required=False,
+                    help='Reduction of the ResNet50 output before the dense head: flatten, '
+                         'global average pooling or global max pooling')
+  parser.add_argument('--frozen_backbone', type=int, choices=[0,1],
+                    default=0, required=False,
+                    help='Training the head only, on ResNet50 features computed once and cached '
+                         '(average pooled, whatever --head)')
+  parser.add_argument('--augmentation', type=int, choices=[0,1],
+                    default=0, required=False,
+                    help='Random flip, rotation and zoom of the training images in a parallel '
+                         'tf.data map')
+  parser.add_argument('--augmentation_seed', type=int, default=None,
+                    help='Seed of the augmentation and of the shuffle of the tf.data pipeline, '
+                         'none for different samples on every run')
+  parser.add_argument('--input_wait_steps', type=int, default=0,
+                    help='Training steps on a batch held in memory after the evaluation, measuring '
+                         'the share of the step time waiting on the tf.data pipeline, 0 not to '
+                         'measure it. The steps update the model and add to the working time')
+  parser.add_argument('--feature_cache_dir', type=str, default=features.FEATURE_CACHE_DIR,
+                    help='Directory of the memory-mapped cache of the frozen backbone features')
+  weights.add_weights_arguments(parser)
+  dataset.add_dataset_arguments(parser)
+  parser.add_argument('--epochs', type=int, default=10,
+                    help='Number of training epochs')
+  accumulation.add_accumulation_arguments(parser)
+  xla.add_xla_arguments(parser)
+  threads.add_thread_arguments(parser)
+  distribute.add_strategy_arguments(parser)
+  profiling.add_profiler_arguments(parser)
+  results.add_results_arguments(parser)
   return parser
 
 
@@ -157,27 +368,47 @@ def main(argv):
   # Setting the batch size
   batch_size = flags.batch_size
   print('Setting batch size = ', batch_size)
+  if not 1 <= flags.accumulation_steps <= batch_size:
+    parser.error('--accumulation_steps must be between 1 and the batch size')
 
+  # TF_GPU_THREAD_MODE is set by threads.configure_environment()
   if flags.gpu_mode == 1:
     print('Setting the GPU on private mode')
-    os.environ['TF_GPU_THREAD_MODE'] = 'gpu_private'
+  threads.configure_tensorflow(flags)
 
+  # Created first, the logical CPU devices are set before TensorFlow initializes
+  strategy = distribute.create_strategy(flags.strategy, flags.nb_replicas)
+  print('Number of replicas: %d' % strategy.num_replicas_in_sync)
+
+  # Set for every run, a sweep in this process must not inherit the previous policy
+  policy = precision.set_policy(precision.policy_name(flags.mixed_precision, flags.policy_type))
   if flags.mixed_precision == 1:
     print("Setting the mixed precision policy")
-    if flags.policy_type == 16:
-      # Defining the precision strategy
-      policy = mixed_precision.Policy('mixed_float16')
-      mixed_precision.set_policy(policy)
-    elif flags.policy_type == 32:
-      # Defining the precision strategy
-      policy = mixed_precision.Policy('float32')
-      mixed_precision.set_policy(policy)
-
     print('Compute dtype: %s' % policy.compute_dtype)
     print('Variable dtype: %s' % policy.variable_dtype)
 
-  model = create_resnet_model()
-  train_model(model, batch_size)
+  if flags.augmentation == 1 and flags.frozen_backbone == 1:
+    parser.error('The frozen backbone is trained on cached features, which are not augmented')
+
+  # Resolved before building anything, a missing weights file fails right away
+  try:
+    conv_weights = weights.resolve_weights(flags.weights, flags.weights_dir,
+                                           flags.allow_download == 1, flags.allow_random_weights == 1)
+  except FileNotFoundError as e:
+    parser.error(str(e))
+  print('Backbone weights: ' + weights.weights_name(conv_weights))
+
+  # Built once per process, configuration and strategy
+  strategy_key = (type(strategy).__name__, strategy.num_replicas_in_sync)
+  with strategy.scope():
+    if flags.frozen_backbone == 1:
+      model = model_factory.cached_model(('resnet50_head', policy.name) + strategy_key, create_head_model)
+    else:
+      key = ('resnet50', flags.normalization, flags.image_size, flags.resize, flags.head,
+             conv_weights, policy.name) + strategy_key
+      model = model_factory.cached_model(key, lambda: create_resnet_model(
+          flags.normalization, flags.image_size, flags.resize, flags.head, conv_weights))
+  train_model(model, flags, conv_weights, strategy)
 
 if __name__ == '__main__':
   start_time = time.time()
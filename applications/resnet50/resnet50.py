@@ -8,43 +8,48 @@ from tensorflow.keras import models
 from tensorflow.keras import layers
 from tensorflow.keras import optimizers
 import tensorflow as tf
-from keras.utils import np_utils
 from keras.models import load_model
 from keras.datasets import cifar10
 from keras.preprocessing import image
 import numpy as np
 import matplotlib.pyplot as plt
 from PIL import Image
-import pandas as pd
 from datetime import datetime
+import os
+import sys
 
-from tensorflow.keras.mixed_precision import experimental as mixed_precision
-policy = mixed_precision.Policy('mixed_float16')
-mixed_precision.set_policy(policy)
+# Shared helpers live in applications/common
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from common import dataset, model_factory, precision, weights
+
+policy = precision.set_policy('mixed_float16')
 # Now design your model and train it
 BATCH_SIZE=20
 #There are 50000 samples in the training dataset. You can select a subset of the traing set hre:
 NB_SAMPLES=50000
+# Seed of the subset sampling, None for a different subset on every run
+SEED=None
+# Input resolution of ResNet50, the 32x32 images are resized to it
+IMAGE_SIZE=256
 
-data_augmentation = tf.keras.Sequential(
-        [preprocessing.RandomFlip("horizontal"),
-         preprocessing.RandomRotation(0.1),
-         preprocessing.RandomZoom(0.1)])
+# The random flip, rotation and zoom of the training images run in the
+# tf.data pipeline: app_resnet50.py --augmentation 1, see common/pipeline.py
 inputs = tf.keras.Input(shape=(32, 32, 3))
 
-conv_base = ResNet50(weights='imagenet', include_top=False, input_shape=(256, 256, 3))
+# Local ImageNet weights when there, see common/weights.py
+conv_base = ResNet50(weights=weights.resolve_weights(), include_top=False, input_shape=(IMAGE_SIZE, IMAGE_SIZE, 3))
 
 # prints the Resnet architecture
 conv_base.summary()
 
 
-(x_train, y_train), (x_test, y_test) = cifar10.load_data()
+# The subset is drawn while the images are still uint8
+x_train, y_train, x_test, y_test = dataset.load_cifar10(NB_SAMPLES, SEED)
 
-x_train = x_train / 255.0
-x_test = x_test / 255.0
+x_train = dataset.normalize(x_train)
+x_test = dataset.normalize(x_test)
 
-y_train = np_utils.to_categorical(y_train, 10)
-y_test = np_utils.to_categorical(y_test, 10)
+# The labels stay int class indices, for the sparse categorical loss
 
 print(x_train.shape)
 print(x_test.shape)
@@ -52,33 +57,17 @@ print(x_test.shape)
 print("There are "+str(x_train.shape[0])+" training samples")
 print("There are "+str(x_test.shape[0])+" testing samples")
 
-df = pd.DataFrame(list(zip(x_train, y_train)), columns =['x_train', 'y_train']) 
-
-val = df.sample(NB_SAMPLES) # take only 5% of the samples
-
-x_train = np.array([ i for i in list(val['x_train'])])
-y_train = np.array([ i for i in list(val['y_train'])])
-
-print("There are "+str(x_train.shape[0])+" training samples")
-print("There are "+str(x_test.shape[0])+" testing samples")
-
 
 model = models.Sequential()
-model.add(layers.UpSampling2D((2,2)))
-model.add(layers.UpSampling2D((2,2)))
-model.add(layers.UpSampling2D((2,2)))
+# A single resize from 32x32 instead of a chain of UpSampling2D
+model.add(preprocessing.Resizing(IMAGE_SIZE, IMAGE_SIZE, interpolation='nearest'))
 model.add(conv_base)
-model.add(layers.Flatten())
-model.add(layers.BatchNormalization())
-model.add(layers.Dense(128, activation='relu'))
-model.add(layers.Dropout(0.5))
-model.add(layers.BatchNormalization())
-model.add(layers.Dense(64, activation='relu'))
-model.add(layers.Dropout(0.5))
-model.add(layers.BatchNormalization())
-model.add(layers.Dense(10, activation='softmax'))
-
-model.compile(optimizer=optimizers.RMSprop(lr=2e-5), loss='binary_crossentropy', metrics=['acc'])
+# Classifier of common/model_factory.py
+for layer in model_factory.build_layers(model_factory.resnet50_head_layers()):
+  model.add(layer)
+
+model.compile(optimizer=precision.wrap_optimizer(optimizers.RMSprop(lr=2e-5)), loss='sparse_categorical_crossentropy',
+              metrics=[tf.keras.metrics.SparseCategoricalAccuracy(name='acc')])
 
 # Create a TensorBoard callback
 logs = "logs/" + datetime.now().strftime("%Y%m%d-%H%M%S")
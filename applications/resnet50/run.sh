@@ -1,35 +1,32 @@
 #!/bin/bash
 
-for (( counter = 64; counter <= 256; counter *= 2 )); do
-        GPU_MODE=0
-        MIXED_PRECISION=0
-        POLICY_TYPE=16
-
-        working_time=$(python3 app_resnet50.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-        echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-        GPU_MODE=1
-        working_time=$(python3 app_resnet50.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-        echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-        GPU_MODE=0
-        MIXED_PRECISION=1
-        POLICY_TYPE=16
-        working_time=$(python3 app_resnet50.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-        echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-        POLICY_TYPE=32
-        working_time=$(python3 app_resnet50.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-        echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE"
-        echo $working_time
-
-        GPU_MODE=1
-        POLICY_TYPE=16
-        working_time=$(python3 app_resnet50.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-        echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-
-        POLICY_TYPE=32
-        working_time=$(python3 app_resnet50.py --batch_size $counter --gpu_mode $GPU_MODE --mixed_precision $MIXED_PRECISION --policy_type $POLICY_TYPE | grep Working | awk '{print $3}')
-        echo -e "$counter\t$GPU_MODE\t$MIXED_PRECISION\t$POLICY_TYPE\t$working_time"
-done
-
+# Number of configurations running at the same time, on disjoint CPU cores
+JOBS=${JOBS:-1}
+# Input resolutions of ResNet50, comma-separated
+IMAGE_SIZE=${IMAGE_SIZE:-256}
+# Heads on the ResNet50 output (flatten, gap, gmp), comma-separated
+HEAD=${HEAD:-flatten}
+# XLA compilation of the training step, 0 and/or 1, comma-separated
+JIT=${JIT:-0}
+# Augmentation of the training images in the tf.data pipeline, 0 and/or 1, comma-separated
+AUGMENTATION=${AUGMENTATION:-0}
+# Training steps measuring the share of the step time waiting on the tf.data pipeline,
+# 0 not to measure it. By default measured by the sweeps of the augmented images only
+if [ "$AUGMENTATION" = 0 ]; then
+  INPUT_WAIT_STEPS=${INPUT_WAIT_STEPS:-0}
+else
+  INPUT_WAIT_STEPS=${INPUT_WAIT_STEPS:-20}
+fi
+# Micro-batches of the gradient accumulation, 1 for none, comma-separated
+ACCUMULATION=${ACCUMULATION:-1}
+# Largest batch sizes found by ../common/batch_probe.py, the batch sizes over them are skipped
+BATCH_LIMITS=${BATCH_LIMITS:-}
+# Structured records of the runs, an interrupted sweep resumes where it stopped
+RESULTS_FILE=${RESULTS_FILE:-results.jsonl}
+
+python3 ../common/sweep.py app_resnet50.py \
+        --batch_size 64 128 256 \
+        --grid image_size=$IMAGE_SIZE head=$HEAD jit=$JIT accumulation_steps=$ACCUMULATION augmentation=$AUGMENTATION \
+               input_wait_steps=$INPUT_WAIT_STEPS \
+        --jobs $JOBS --retries 1 \
+        --results_file $RESULTS_FILE --resume ${BATCH_LIMITS:+--batch_limits $BATCH_LIMITS}
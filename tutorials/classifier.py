@@ -9,10 +9,19 @@ import matplotlib.pyplot as plt
 
 # OS directory
 import os
+import sys
+import json
 
 base_path = os.path.dirname(os.path.realpath(__file__))
 image_path = base_path + "/images/"
 
+# Memory-mapped dataset cache shared with the applications
+sys.path.append(os.path.join(base_path, '..', 'applications'))
+from common import dataset, inference
+
+# Batch of the predictions of the test set, the largest batch of the latency report
+INFERENCE_BATCH_SIZE = max(inference.BATCH_SIZES)
+
 print(tf.__version__)
 # print(device_lib.list_local_devices())
 
@@ -23,9 +32,7 @@ if not device_name:
 print('Found GPU at: {}'.format(device_name))
 '''
 
-fashion_mnist = keras.datasets.fashion_mnist
-
-(train_images, train_labels), (test_images, test_labels) = fashion_mnist.load_data()
+(train_images, train_labels, test_images, test_labels) = dataset.load_dataset('fashion_mnist')
 
 class_names = ['T-shirt/top', 'Trouser', 'Pullover', 'Dress', 'Coat',
                'Sandal', 'Shirt', 'Sneaker', 'Bag', 'Ankle boot']
@@ -84,12 +91,23 @@ print('\nTest accuracy:', test_acc)
 ## Faire des prédictions
 probability_model = tf.keras.Sequential([model, 
                                          tf.keras.layers.Softmax()])
-predictions = probability_model.predict(test_images)
+# Compiled once and warmed up, then served by batches
+predictor = inference.BatchPredictor(probability_model, INFERENCE_BATCH_SIZE)
+predictor.warmup(test_images)
+predictions = predictor.predict(test_images)
+# Computed once for all the plots
+predicted_labels = np.argmax(predictions, axis=1)
+confidences = np.max(predictions, axis=1)
 predictions[0]
-np.argmax(predictions[0])
+predicted_labels[0]
 test_labels[0]
 
-def plot_image(i, predictions_array, true_label, img):
+# Latency of a single image against batches, through the predictor and through model.predict()
+for measure in (inference.measure_latency(predictor, test_images)
+                + inference.measure_predict_latency(probability_model, test_images)):
+  print("Inference: " + json.dumps(measure))
+
+def plot_image(i, true_label, img):
   true_label, img = true_label[i], img[i]
   plt.grid(False)
   plt.xticks([])
@@ -97,14 +115,14 @@ def plot_image(i, predictions_array, true_label, img):
 
   plt.imshow(img, cmap=plt.cm.binary)
 
-  predicted_label = np.argmax(predictions_array)
+  predicted_label = predicted_labels[i]
   if predicted_label == true_label:
     color = 'blue'
   else:
     color = 'red'
 
   plt.xlabel("{} {:2.0f}% ({})".format(class_names[predicted_label],
-                                100*np.max(predictions_array),
+                                100*confidences[i],
                                 class_names[true_label]),
                                 color=color)
 
@@ -115,7 +133,7 @@ def plot_value_array(i, predictions_array, true_label):
   plt.yticks([])
   thisplot = plt.bar(range(10), predictions_array, color="#777777")
   plt.ylim([0, 1])
-  predicted_label = np.argmax(predictions_array)
+  predicted_label = predicted_labels[i]
 
   thisplot[predicted_label].set_color('red')
   thisplot[true_label].set_color('blue')
@@ -123,7 +141,7 @@ def plot_value_array(i, predictions_array, true_label):
 i = 0
 figure0 = plt.figure(figsize=(6,3))
 plt.subplot(1,2,1)
-plot_image(i, predictions[i], test_labels, test_images)
+plot_image(i, test_labels, test_images)
 plt.subplot(1,2,2)
 plot_value_array(i, predictions[i],  test_labels)
 #plt.show()
@@ -133,7 +151,7 @@ figure0.savefig(os.path.join(image_path, "prediction1"))
 i = 12
 figure12 = plt.figure(figsize=(6,3))
 plt.subplot(1,2,1)
-plot_image(i, predictions[i], test_labels, test_images)
+plot_image(i, test_labels, test_images)
 plt.subplot(1,2,2)
 plot_value_array(i, predictions[i],  test_labels)
 #plt.show()
@@ -148,7 +166,7 @@ num_images = num_rows*num_cols
 figArray = plt.figure(figsize=(2*2*num_cols, 2*num_rows))
 for i in range(num_images):
   plt.subplot(num_rows, 2*num_cols, 2*i+1)
-  plot_image(i, predictions[i], test_labels, test_images)
+  plot_image(i, test_labels, test_images)
   plt.subplot(num_rows, 2*num_cols, 2*i+2)
   plot_value_array(i, predictions[i], test_labels)
 figArray.tight_layout()
@@ -165,7 +183,7 @@ img = (np.expand_dims(img,0))
 
 print(img.shape)
 
-predictions_single = probability_model.predict(img)
+predictions_single = predictor.predict_batch(img)
 
 print(predictions_single)
 
@@ -2,8 +2,14 @@ from datetime import datetime
 from packaging import version
 
 import os
+import sys
+import numpy as np
 import tensorflow as tf
 
+# Memory-mapped dataset cache shared with the applications
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'applications'))
+from common import dataset
+
 print("TensorFlow version: ", tf.__version__)
 
 
@@ -12,16 +18,15 @@ if not device_name:
   raise SystemError('GPU device not found')
 print('Found GPU at: {}'.format(device_name))
 
-import tensorflow_datasets as tfds
-tfds.disable_progress_bar()
+train_images, train_labels, test_images, test_labels = dataset.load_dataset('mnist')
 
-(ds_train, ds_test), ds_info = tfds.load(
-    'mnist',
-    split=['train', 'test'],
-    shuffle_files=True,
-    as_supervised=True,
-    with_info=True,
-)
+def load_mnist():
+  """Builds the MNIST datasets from the memory-mapped .npy cache."""
+  ds_train = tf.data.Dataset.from_tensor_slices((train_images[..., np.newaxis], train_labels))
+  ds_test = tf.data.Dataset.from_tensor_slices((test_images[..., np.newaxis], test_labels))
+  return ds_train, ds_test
+
+ds_train, ds_test = load_mnist()
 
 def normalize_img(image, label):
   """Normalizes images: `uint8` -> `float32`."""
@@ -57,13 +62,7 @@ model.fit(ds_train,
           validation_data=ds_test,
           callbacks = [tboard_callback])
 
-(ds_train, ds_test), ds_info = tfds.load(
-    'mnist',
-    split=['train', 'test'],
-    shuffle_files=True,
-    as_supervised=True,
-    with_info=True,
-)
+ds_train, ds_test = load_mnist()
 
 ds_train = ds_train.map(normalize_img)
 ds_train = ds_train.batch(128)